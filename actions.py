@@ -1,25 +1,47 @@
 from abc import ABC, abstractmethod
 import asyncio
-from datetime import datetime
 import json
-import re
-from typing import Any, Awaitable, Callable, Generator, Iterable
-from itertools import chain
+import time
+from typing import (Any, AsyncIterable, Awaitable, Callable, Generator,
+                    Iterable, Sized)
 
 from websockets import connect
 
 from config_produser import ConfigProdiser
-from core import colors, get_auth_header
+from connections import BrokerSession, ConnectionsAbc, build_connections
+from core import ainput, get_auth_header
 from dtos import ControllerStatus, WorkerResponse, Config
-from executor import PoolExecutor
+from downloads import DownloadSlot, DownloadSlots
+from events import (Approved, Discovered, EventBus, Failed, Notice,
+                    PhaseFinished, PhaseSkipped, PhaseStarted, Progress,
+                    Rejected, RolloutHalted, UpToDate, Updated, WorkerError)
+from executor import AdaptiveLimiter, Channel, PoolExecutor
+from filters import ControllerFilter
+from frames import Frame
+from handshake import HandshakeStats, SubscribeHandshake
+from inventory import Inventory, iter_controllers
+from priority import PriorityScheduler, UpdatePriority, estimate_makespan
+from retry import RetryPolicy
+from timeouts import UpdateTimeouts, update_durations
+from versions import VersionCache, extract_versions
+from waves import WaveScheduler
 from writer import ReportWriter
 
 
 class ActionsAbc(ABC):
-    def __init__(self, config: Config, writer: ReportWriter) -> None:
+    def __init__(self, config: Config, writer: ReportWriter,
+                 connections: ConnectionsAbc | None = None,
+                 events: EventBus | None = None) -> None:
         self.config = config
         self.exec = PoolExecutor(config)
         self.writer = writer
+        self.events = events or EventBus.console()
+        self.connections = connections or build_connections(config,
+                                                            self.events)
+        # limit of the workers shared by the brokers of the run
+        self.limit: asyncio.Semaphore | None = None
+        # skip the confirmation prompts
+        self.confirmed = False
         self.run = self.validate_action(func=self.run)
 
     @abstractmethod
@@ -33,100 +55,147 @@ class ActionsAbc(ABC):
         if action should be executed 
         """
 
+    async def confirm(self, prompt: str):
+        """
+        Ask for the confirmation, unless the run is already confirmed
+        """
+        if not (self.confirmed or ConfigProdiser.already_confirmed()):
+            await ainput(prompt)
+
+    def worker_error(self, phase: str) -> Callable[[Any, Exception], None]:
+        """
+        Report unexpected exceptions of the workers of the phase
+        """
+        def on_error(payload: Any, error: Exception):
+            self.events.emit(WorkerError(
+                str(payload), error=f"{type(error).__name__}: {error}"))
+        return on_error
+
+    def limited(
+        self,
+        func: Callable[[str], Awaitable[WorkerResponse]],
+    ) -> Callable[[str], Awaitable[WorkerResponse]]:
+        """
+        Hold the slot of the shared limit while the worker runs
+        """
+        if self.limit is None:
+            return func
+
+        async def wrapper(uid: str) -> WorkerResponse:
+            async with self.limit:
+                return await func(uid)
+        return wrapper
+
+    def timed(
+        self,
+        phase: str,
+        func: Callable[[str], Awaitable[WorkerResponse]],
+    ) -> Callable[[str], Awaitable[WorkerResponse]]:
+        """
+        Mark the end of the worker in metrics
+        """
+        async def wrapper(uid: str) -> WorkerResponse:
+            try:
+                return await func(uid)
+            finally:
+                self.writer.metrics.mark(phase, uid, "done")
+        return wrapper
+
 
 class GetControllers(ActionsAbc):
-    def __init__(self, config: Config, writer: ReportWriter) -> None:
-        super().__init__(config, writer)
+    def __init__(self, config: Config, writer: ReportWriter,
+                 connections: ConnectionsAbc | None = None,
+                 events: EventBus | None = None) -> None:
+        super().__init__(config, writer, connections, events)
         self.url = config.websockets.build_url(controller_uid="null")
         self.headers = {"Authorization": get_auth_header(config)}
 
-    def validate_action(self, func: Callable[[None],
-                                             Awaitable[list[ControllerStatus]]]):
+    def validate_action(self, func: Callable[[None], Awaitable[Inventory]]):
         async def wrapper():
             return await func()
         return wrapper
 
     def filter_controllers(
         self,
-        controllers: list[ControllerStatus],
+        controllers: Iterable[ControllerStatus],
     ) -> Generator[ControllerStatus, None, None]:
-        if self.config.controllers_whitelist:
-            controllers_uid = [c2.uid for c2 in controllers]
-            controllers_gen = chain(
-                (
-                    c for c in controllers
-                    if c.uid in self.config.controllers_whitelist
-                 ),
-                (
-                    ControllerStatus(uid=c, status="offline")
-                    for c in self.config.controllers_whitelist
-                    if c not in controllers_uid
-                ),
-            )
-        else:
-            controllers_gen = (
-                c for c in controllers
-                if c.uid not in self.config.controllers_blacklist
-            )
-        if self.config.controller_uid_regex:
-            pattern = re.compile(self.config.controller_uid_regex)
-            controllers_gen = (c for c in controllers_gen if pattern.fullmatch(c.uid))
-        return controllers_gen
+        return ControllerFilter.from_config(self.config).filter(controllers)
 
-    async def run(self) -> list[ControllerStatus]:
-        print("\nRequest all connected controllers:")
-        controllers_states = {"online": [], "inactive": [], "offline": []}
+    def discover(
+        self,
+        controllers: Iterable[ControllerStatus],
+    ) -> Generator[ControllerStatus, None, None]:
+        for c in controllers:
+            self.events.emit(Discovered(c.uid, status=c.status))
+            yield c
+
+    async def request(self) -> str:
+        """
+        Return raw get_all_controllers reply of the broker
+        """
         message = {
             "action": "get_all_controllers",
             "uid": "null",
         }
-        controllers: list[ControllerStatus]
-        result: list[ControllerStatus] = []
         async with connect(self.url, additional_headers=self.headers) as ws:
             await ws.send(json.dumps(message))
             while True:
                 async with asyncio.timeout(5):
-                    resp = await ws.recv()
-                resp = json.loads(resp)
-                if resp.get("action") == "get_all_controllers":
-                    controllers = [ControllerStatus(**c)
-                                   for c in resp["controllers"]]
-                    break
-        for cont in self.filter_controllers(controllers):
-            match cont.status:
-                case "online":
-                    controllers_states["online"].append(cont.uid)
-                    result.append(cont)
-                case "inactive":
-                    controllers_states["inactive"].append(cont.uid)
-                    result.append(cont)
-                case _:
-                    controllers_states["offline"].append(cont.uid)
-        controllers_states["total_available"] = len(controllers_states["online"]) + len(controllers_states["inactive"])
-        controllers_states["total_unavailable"] = len(controllers_states["offline"])
-        print(controllers_states["total_available"],
-              "controllers available")
+                    frame = Frame(await ws.recv())
+                if frame.matches("action", "get_all_controllers"):
+                    return frame.raw
+
+    async def run(self) -> Inventory:
+        """
+        Return available controllers. Controllers are filtered
+        while the reply is decoded
+        """
+        self.events.emit(PhaseStarted("discover"))
+        inventory = Inventory.from_controllers(
+            self.discover(self.filter_controllers(
+                iter_controllers(await self.request()))))
+        controllers_states = inventory.states()
+        self.events.emit(PhaseFinished("discover", totals={
+            k: v for k, v in controllers_states.items()
+            if k.startswith("total_")}))
         self.writer.write_yaml_file(
             data=controllers_states,
             file_name="controllers_states.yaml")
-        return result
+        return inventory
 
 
 class ValidateControllers(ActionsAbc):
-    def __init__(self, config: Config, writer: ReportWriter) -> None:
-        super().__init__(config, writer)
-        self.headers = {"Authorization": get_auth_header(config)}
+    def __init__(self, config: Config, writer: ReportWriter,
+                 connections: ConnectionsAbc | None = None,
+                 events: EventBus | None = None) -> None:
+        super().__init__(config, writer, connections, events)
         self.request_timeout = config.actions.validate.timeout
+        self.versions = VersionCache(
+            config.report_writer.build_report_dir_path(),
+            ttl=config.actions.validate.version_cache_ttl)
+        # controllers, which status didn't change since the last run.
+        # Their cached versions are used regardless of the ttl
+        self.unchanged: set[str] = set()
+        self.handshakes = HandshakeStats(
+            config.websockets.subscribe_handshake)
 
-    def validate_action(self, func: Callable[[list[ControllerStatus]],
+    def is_up_to_date(self, versions: dict[str, str]) -> bool:
+        """
+        Return True, if the target build is already installed
+        """
+        return (self.config.software_version is not None
+                and versions.get(self.config.software_name)
+                == self.config.software_version)
+
+    def validate_action(self, func: Callable[[Iterable[ControllerStatus]],
                                              Awaitable[list[str]]]):
-        async def wrapper(controllers: list[ControllerStatus]):
+        async def wrapper(controllers: Iterable[ControllerStatus],
+                          channel: Channel | None = None):
             if self.config.actions.validate.enabled:
-                if not ConfigProdiser.already_confirmed():
-                    input("Push Enter to validate controllers or Ctrl+C to exit")
-                return await func(controllers)
-            print(colors.yellow(
-                "Validation action is disable in config. Skip."))
+                await self.confirm("Push Enter to validate controllers "
+                                   "or Ctrl+C to exit")
+                return await func(controllers, channel=channel)
+            self.events.emit(PhaseSkipped("validate"))
             return [c.uid for c in controllers]
         return wrapper
 
@@ -134,11 +203,8 @@ class ValidateControllers(ActionsAbc):
         def save_response(resp: str):
             if not self.config.report_writer.detail_report:
                 return
-            now = datetime.now()
-            self.writer.write_text_file(
-                data=f"{now.strftime("%d-%m-%Y_%H:%M:%S.%s")} | {resp}",
-                file_name=f"{uid}.txt",
-                dir_name="get_controller_version")
+            self.writer.write_detail(frame=resp, uid=uid,
+                                     phase="get_controller_version")
         get_all_versions = {
             "action": "updater_command",
             "command": "get_all_versions",
@@ -147,91 +213,167 @@ class ValidateControllers(ActionsAbc):
         admin_subscribe = {
             "action": "admin_subscribe",
             "uid": uid}
-        url = self.config.websockets.build_url(uid, client_id=f"{uid}_worker")
-        async with connect(url, additional_headers=self.headers) as websocket:
-            await websocket.send(json.dumps(admin_subscribe))
-            await asyncio.sleep(.2)
-            await websocket.send(json.dumps(get_all_versions))
-            resp: dict = {}
+        cached_versions = self.versions.get(
+            uid, ignore_ttl=uid in self.unchanged)
+        if cached_versions is not None:
+            return WorkerResponse(
+                response={"feedback_type": "all_software_versions",
+                          "versions": cached_versions, "cached": True},
+                uid=uid, status="success")
+        metrics = self.writer.metrics
+        metrics.mark("validate", uid, "connect_start")
+        hold = self.config.actions.update.enabled
+        async with self.connections.open(uid, hold=hold) as session:
+            metrics.mark("validate", uid, "connect_end")
+            handshake = SubscribeHandshake(session, self.config.websockets)
+            if not session.subscribed:
+                metrics.mark("validate", uid, "subscribe_sent")
+            await handshake.run(admin_subscribe)
+            self.handshakes.add(handshake)
+            if handshake.state == "subscribed":
+                metrics.mark("validate", uid, "subscribed")
+            await session.send(get_all_versions)
+            metrics.mark("validate", uid, "command_sent")
             while True:
                 try:
                     async with asyncio.timeout(self.request_timeout):
-                        resp = await websocket.recv()
-                        save_response(resp)
-                        resp = json.loads(resp)
-                        if resp.get("feedback_type") == "all_software_versions":
-                            return WorkerResponse(response=resp,
+                        frame = await handshake.recv()
+                        metrics.mark_first("validate", uid, "first_frame")
+                        save_response(frame.raw)
+                        if frame.matches("feedback_type",
+                                         "all_software_versions"):
+                            return WorkerResponse(response=frame.data,
                                                   uid=uid, status="success")
                 except asyncio.TimeoutError:
                     return WorkerResponse(response=None, uid=uid,
                                           status="error")
 
     async def run(self,
-                  controllers: list[ControllerStatus]) -> list[str]:
+                  controllers: Iterable[ControllerStatus],
+                  channel: Channel | None = None) -> list[str]:
         """
-            Return list of controllers uid, that can be updated
+            Return list of controllers uid, that can be updated.
+            If channel is provided, approved uids are put into it
+            as soon as they are approved
         """
-        print("\nValidate connected controllers:")
+        try:
+            return await self.__run(controllers, channel)
+        finally:
+            if channel is not None:
+                await channel.close()
+
+    async def __run(self,
+                    controllers: Iterable[ControllerStatus],
+                    channel: Channel | None) -> list[str]:
+        self.events.emit(PhaseStarted("validate"))
         approved_controllers = []
         rejected_controllers = []
-        active_controllers = [c.uid for c in controllers
-                              if c.status != "offline"]
-        # a = next(active_controllers)
-        # active_controllers = (a for _ in range(100))
-        executor = PoolExecutor(config=self.config)
-        result = executor.run(func=self.__worker,
-                              payload=active_controllers)
+        up_to_date_controllers = []
+        active_controllers = (c.uid for c in controllers
+                              if c.status != "offline")
+        total = len(controllers) if isinstance(controllers, Sized) else None
+        executor = PoolExecutor(
+            config=self.config,
+            pool_size=self.config.actions.validate.max_pool_size,
+            on_error=self.worker_error("validate"))
+        retry = RetryPolicy(self.config.actions.validate.retry, self.events)
+        result = executor.run(
+            func=self.timed("validate",
+                            retry.wrap(self.limited(self.__worker))),
+            payload=active_controllers)
+        self.writer.metrics.watch("validate", executor)
         resp: WorkerResponse
         counter = 1
-        async for resp in result:
-            prefix = f"[{counter}/{len(active_controllers)}]"
-            counter += 1
-            if resp.status == "error":
-                print(prefix, resp.uid, colors.red("REJECTED"))
-                rejected_controllers.append(resp.uid)
-                continue
-            print(prefix, resp.uid, colors.green("APPROVED"))
-            approved_controllers.append(resp.uid)
+        attempts = {}
+        try:
+            async for resp in result:
+                position = {"index": counter, "total": total,
+                            "attempts": resp.attempts}
+                counter += 1
+                self.writer.journal.record(uid=resp.uid, phase="validate",
+                                           status=resp.status,
+                                           attempts=resp.attempts)
+                self.writer.metrics.outcome("validate", resp.uid, resp.status)
+                if resp.attempts > 1:
+                    attempts[resp.uid] = resp.attempts
+                if resp.status == "error":
+                    self.events.emit(Rejected(
+                        resp.uid, error_kind=resp.error_kind, **position))
+                    rejected_controllers.append(resp.uid)
+                    await self.connections.release(resp.uid)
+                    continue
+                versions = extract_versions(resp.response)
+                cached = bool(resp.response.get("cached"))
+                if not cached:
+                    self.versions.set(resp.uid, versions)
+                if self.is_up_to_date(versions):
+                    self.events.emit(UpToDate(resp.uid, versions=versions,
+                                              cached=cached, **position))
+                    up_to_date_controllers.append(resp.uid)
+                    await self.connections.release(resp.uid)
+                    continue
+                self.events.emit(Approved(resp.uid, versions=versions,
+                                          cached=cached, **position))
+                approved_controllers.append(resp.uid)
+                if channel is not None:
+                    await channel.put(resp.uid)
+        finally:
+            result.close()
+        states = {
+            "approved_controllers": approved_controllers,
+            "rejected_controllers": rejected_controllers,
+            "total_approved_controllers": len(approved_controllers),
+            "total_rejected_controllers": len(rejected_controllers)
+        }
+        if attempts:
+            states["validation_attempts"] = attempts
+        if self.handshakes.states:
+            states["subscribe_handshake"] = self.handshakes.summary()
+        if self.config.software_version is not None:
+            states["up_to_date_controllers"] = up_to_date_controllers
+            states["total_up_to_date_controllers"] = len(
+                up_to_date_controllers)
         self.writer.write_yaml_file(
             file_name="controllers_states.yaml",
-            data={
-                "approved_controllers": approved_controllers,
-                "rejected_controllers": rejected_controllers,
-                "total_approved_controllers": len(approved_controllers),
-                "total_rejected_controllers": len(rejected_controllers)
-            },
+            data=states,
         )
-        print(len(approved_controllers), "controllers approved")
+        self.versions.save()
+        self.events.emit(PhaseFinished("validate", totals={
+            k: v for k, v in states.items() if k.startswith("total_")}))
         return approved_controllers
 
 
 class UpdateControllers(ActionsAbc):
-    def __init__(self, config: Config, writer: ReportWriter) -> None:
-        super().__init__(config, writer)
-        self.headers = {"Authorization": get_auth_header(config)}
+    def __init__(self, config: Config, writer: ReportWriter,
+                 connections: ConnectionsAbc | None = None,
+                 events: EventBus | None = None) -> None:
+        super().__init__(config, writer, connections, events)
         self.request_timeout = config.actions.update.timeout
+        self.downloads = DownloadSlots(config.actions.update.downloads)
+        self.versions = VersionCache(
+            config.report_writer.build_report_dir_path(),
+            ttl=config.actions.validate.version_cache_ttl)
+        # uids of the inactive controllers for the priority policies
+        self.inactive: set[str] = set()
+        self.stall_timeout = config.actions.update.stall_timeout
+        self.timeouts: UpdateTimeouts | None = None
+        if config.actions.update.adaptive_timeout.enabled:
+            self.timeouts = UpdateTimeouts.from_reports(
+                config.actions.update.adaptive_timeout,
+                base_dir=config.report_writer.build_report_dir_path())
 
     def validate_action(self, func: Callable[[list[ControllerStatus]],
                                              Awaitable[None]]):
-        async def wrapper(controllers_uids: Iterable[str]):
+        async def wrapper(controllers_uids: Iterable[str] | AsyncIterable[str]):
             if self.config.actions.update.enabled:
-                if not ConfigProdiser.already_confirmed():
-                    input("Push Enter to update controllers or Ctrl+C to exit")
+                await self.confirm("Push Enter to update controllers "
+                                   "or Ctrl+C to exit")
                 return await func(controllers_uids)
-            print(colors.yellow(
-                "Update action is disable in config. Skip."))
+            self.events.emit(PhaseSkipped("update"))
             return
         return wrapper
 
     async def __worker(self, uid: str) -> WorkerResponse:
-        def save_response(resp: str):
-            if not self.config.report_writer.detail_report:
-                return
-            now = datetime.now()
-            self.writer.write_text_file(
-                data=f"{now.strftime("%d-%m-%Y_%H:%M:%S.%s")} | {resp}",
-                file_name=f"{uid}.txt",
-                dir_name="update_software")
         message = {
             "action": "updater_command",
             "command": "update_software",
@@ -239,59 +381,212 @@ class UpdateControllers(ActionsAbc):
             "url": self.config.software_build_url,
             "token": self.config.file_service_token
         }
-        url = self.config.websockets.build_url(uid, client_id=f"{uid}_worker")
-        async with connect(url, additional_headers=self.headers) as websocket:
-            await websocket.send(json.dumps(message))
-            resp: dict = {}
-            while True:
-                try:
-                    async with asyncio.timeout(self.request_timeout):
-                        resp_raw = await websocket.recv()
-                        resp = json.loads(resp_raw)
-                        action = resp.get("action")
-                        feedback_type = resp.get("feedback_type")
-                        if action != "updater_feedback":
-                            continue
-                        save_response(resp_raw)
-                        if feedback_type == "update_progress":
-                            continue
-                        if feedback_type == "error":
-                            return WorkerResponse(
-                                response=resp, uid=uid, status="error"
-                            )
-                except asyncio.TimeoutError:
-                    return WorkerResponse(response=None,
-                                          uid=uid,
-                                          status="error")
+        metrics = self.writer.metrics
+        async with self.downloads.slot() as slot:
+            metrics.mark("update", uid, "connect_start")
+            async with self.connections.open(uid) as session:
+                metrics.mark("update", uid, "connect_end")
+                if session.requires_subscribe and not session.subscribed:
+                    # feedback of the shared connection comes by subscription
+                    handshake = SubscribeHandshake(session,
+                                                   self.config.websockets)
+                    await handshake.run({"action": "admin_subscribe",
+                                         "uid": uid})
+                return await self.__wait_result(uid, session, message, slot)
 
-    async def run(self, controllers_uids: Iterable[str]):
+    async def __wait_result(self, uid: str, session: BrokerSession,
+                            message: dict, slot: DownloadSlot) -> WorkerResponse:
+        def save_response(resp: str):
+            if not self.config.report_writer.detail_report:
+                return
+            self.writer.write_detail(frame=resp, uid=uid,
+                                     phase="update_software")
+        metrics = self.writer.metrics
+        loop = asyncio.get_running_loop()
+        await session.send(message)
+        metrics.mark("update", uid, "command_sent")
+        started = last_progress = loop.time()
+        deadline = self.timeouts.get(uid) if self.timeouts else None
+        finished_feedback = self.config.actions.update.finished_feedback
+        while True:
+            # the nearest of the frame, stall and update deadlines
+            limits = {"frame": loop.time() + self.request_timeout}
+            if self.stall_timeout is not None:
+                limits["stall"] = last_progress + self.stall_timeout
+            if deadline is not None:
+                limits["deadline"] = started + deadline
+            reason = min(limits, key=limits.get)
+            try:
+                async with asyncio.timeout_at(limits[reason]):
+                    frame = Frame(await session.recv())
+            except asyncio.TimeoutError:
+                return WorkerResponse(response=None, uid=uid, status="error",
+                                      timeout_reason=reason)
+            metrics.mark_first("update", uid, "first_frame")
+            if not frame.matches("action", "updater_feedback"):
+                continue
+            save_response(frame.raw)
+            if frame.matches("feedback_type", "update_progress"):
+                metrics.mark("update", uid, "last_progress")
+                last_progress = loop.time()
+                slot.feed(frame)
+                downloads = self.config.actions.update.downloads
+                self.events.emit(Progress(
+                    uid, progress=frame.get(downloads.progress_field),
+                    stage=frame.get(downloads.stage_field)))
+                continue
+            if frame.matches("feedback_type", "error"):
+                status = "error"
+            elif frame.get("feedback_type") in finished_feedback:
+                status = "success"
+            else:
+                # unknown feedback, e.g. late answer of the validation
+                # over the held session
+                continue
+            return WorkerResponse(response=frame.data, uid=uid,
+                                  status=status,
+                                  duration=loop.time() - started)
+
+    async def run(self,
+                  controllers_uids: Iterable[str] | AsyncIterable[str]):
         if not controllers_uids:
-            print(colors.yellow("No controllers to update."),
-                  "Exit.", sep="\n")
+            self.events.emit(PhaseSkipped("update", reason="empty"))
             return
-        print("\nUpdate connected controllers:")
+        self.events.emit(PhaseStarted("update"))
+        if not self.config.actions.update.finished_feedback:
+            self.events.emit(Notice(
+                "actions.update.finished_feedback is not set: updates "
+                "finish only with an error or a timeout", level="warning"))
+        if self.timeouts is not None:
+            default = self.timeouts.default
+            self.events.emit(Notice(
+                f"Adaptive timeouts from {self.timeouts.samples} updates: "
+                f"{len(self.timeouts.timeouts)} controllers, "
+                + (f"default {default:.1f}s" if default else "no default")))
         failed_controllers = []
         updated_controllers = []
-        executor = PoolExecutor(config=self.config)
-        result = executor.run(self.__worker,
-                              payload=controllers_uids)
+        limiter = None
+        if self.config.actions.update.adaptive_concurrency.enabled:
+            limiter = AdaptiveLimiter(
+                self.config.actions.update.adaptive_concurrency)
+        waves_enabled = self.config.actions.update.waves.enabled
+        priority = None
+        naive_order: list[str] = []
+        if self.config.actions.update.priority.enabled:
+            priority = UpdatePriority(
+                self.config.actions.update.priority, inactive=self.inactive,
+                durations=update_durations(
+                    self.config.report_writer.build_report_dir_path(),
+                    runs=self.config.actions.update.priority.history_runs))
+            if isinstance(controllers_uids, AsyncIterable) and not waves_enabled:
+                controllers_uids = PriorityScheduler(controllers_uids,
+                                                     key=priority.key)
+                naive_order = controllers_uids.arrived
+            else:
+                if isinstance(controllers_uids, AsyncIterable):
+                    controllers_uids = [uid async for uid in controllers_uids]
+                naive_order = list(controllers_uids)
+                controllers_uids = priority.order(naive_order)
+        waves = None
+        if waves_enabled:
+            if isinstance(controllers_uids, AsyncIterable):
+                controllers_uids = [uid async for uid in controllers_uids]
+            waves = WaveScheduler(self.config.actions.update.waves,
+                                  uids=list(controllers_uids),
+                                  events=self.events)
+            controllers_uids = waves
+        executor = PoolExecutor(
+            config=self.config,
+            pool_size=self.config.actions.update.max_pool_size,
+            limiter=limiter, on_error=self.worker_error("update"))
+        retry = RetryPolicy(self.config.actions.update.retry, self.events)
+        started = time.monotonic()
+        result = executor.run(
+            self.timed("update", retry.wrap(self.limited(self.__worker))),
+            payload=controllers_uids)
+        self.writer.metrics.watch("update", executor)
         resp: WorkerResponse
-        async for resp in result:
-            if resp.status == "error":
-                print(resp.uid, "update", colors.red(
-                    "FAILED" if resp.response else "TIMEOUT"))
-                failed_controllers.append(resp.uid)
-                continue
-            print(resp.uid, colors.green("UPDATED"))
-            updated_controllers.append(resp.uid)
+        attempts = {}
+        try:
+            async for resp in result:
+                if waves is not None:
+                    waves.record(resp)
+                self.writer.journal.record(
+                    uid=resp.uid, phase="update", status=resp.status,
+                    build_url=self.config.software_build_url,
+                    attempts=resp.attempts, duration=resp.duration,
+                    timeout_reason=resp.timeout_reason)
+                self.writer.metrics.outcome("update", resp.uid, resp.status)
+                if resp.attempts > 1:
+                    attempts[resp.uid] = resp.attempts
+                if resp.status == "error":
+                    self.events.emit(Failed(
+                        resp.uid, response=resp.response,
+                        timeout_reason=resp.timeout_reason,
+                        attempts=resp.attempts))
+                    failed_controllers.append(resp.uid)
+                    continue
+                self.events.emit(Updated(resp.uid, duration=resp.duration,
+                                         attempts=resp.attempts))
+                updated_controllers.append(resp.uid)
+                if self.config.software_version is not None:
+                    versions = self.versions.get(
+                        resp.uid, ignore_ttl=True) or {}
+                    self.versions.set(resp.uid, {
+                        **versions, self.config.software_name:
+                        self.config.software_version})
+        finally:
+            result.close()
+        update_result = {
+            "updated_controllers": updated_controllers,
+            "failed_controllers": failed_controllers,
+            "total_updated_controllers": len(updated_controllers),
+            "total_failed_controllers": len(failed_controllers)
+        }
+        if attempts:
+            update_result["update_attempts"] = attempts
+        if self.config.software_version is not None:
+            self.versions.save()
         self.writer.write_yaml_file(
             file_name="update_result.yaml",
-            data={
-                "updated_controllers": updated_controllers,
-                "failed_controllers": failed_controllers,
-                "total_updated_controllers": len(updated_controllers),
-                "total_failed_controllers": len(failed_controllers)
-            },
+            data=update_result,
         )
-        print(len(updated_controllers), "controllers updated")
+        if limiter is not None:
+            self.writer.write_yaml_file(
+                file_name="concurrency_log.yaml",
+                data={"concurrency_log": limiter.log})
+        if priority is not None:
+            makespan = {
+                "policies": self.config.actions.update.priority.policies,
+                "makespan": round(time.monotonic() - started, 3),
+                "estimated_makespan_naive": round(estimate_makespan(
+                    naive_order, executor.pool_size,
+                    priority.expected_duration), 3),
+                "estimated_makespan_priority": round(estimate_makespan(
+                    priority.order(naive_order), executor.pool_size,
+                    priority.expected_duration), 3),
+                "controllers_with_history": len(priority.expected),
+            }
+            self.writer.write_yaml_file(file_name="priority.yaml",
+                                        data=makespan)
+            self.events.emit(Notice(
+                f"Makespan {makespan["makespan"]:.1f}s, estimated "
+                f"{makespan["estimated_makespan_priority"]:.1f}s "
+                f"with priority and "
+                f"{makespan["estimated_makespan_naive"]:.1f}s in the "
+                "received order"))
+        if self.config.actions.update.downloads.enabled:
+            self.writer.write_yaml_file(
+                file_name="downloads.yaml",
+                data={"downloads": self.downloads.summary()})
+        if waves is not None:
+            self.writer.write_yaml_file(file_name="waves.yaml",
+                                        data={"waves": waves.summary()})
+            for wave in waves.waves:
+                if wave.status == "halted":
+                    self.events.emit(RolloutHalted(wave.number))
+                    break
+        self.events.emit(PhaseFinished("update", totals={
+            k: v for k, v in update_result.items()
+            if k.startswith("total_")}))
         return updated_controllers
@@ -0,0 +1,59 @@
+"""
+Entry point for running rollouts from the application code, without
+the command line and its prompts:
+
+    from api import Rollout
+    from events import Failed
+
+    async for event in Rollout(Config(**data)):
+        if isinstance(event, Failed):
+            ...
+"""
+import asyncio
+from contextlib import suppress
+from typing import AsyncIterator
+
+from dtos import Config
+from events import Event, EventBus
+from main import App
+
+
+class Rollout:
+    """
+    Single rollout of the config. Iteration runs the rollout and yields
+    its events as they happen. Errors of the run are raised by the
+    iteration after the last event
+    """
+
+    def __init__(self, config: Config, dir_path: str | None = None,
+                 resume_dir: str | None = None, console: bool = False) -> None:
+        self.events = EventBus.console() if console else EventBus()
+        self.app = App(config, resume_dir=resume_dir, dir_path=dir_path,
+                       events=self.events, confirmed=True)
+
+    @property
+    def report_dir(self) -> str:
+        return self.app.writer.dir_path
+
+    async def run(self):
+        """
+        Run the rollout. Events are delivered to the subscribers
+        and the opened streams of the bus
+        """
+        try:
+            await self.app.run_actions()
+        finally:
+            self.events.close()
+
+    async def __aiter__(self) -> AsyncIterator[Event]:
+        stream = self.events.stream()
+        task = asyncio.create_task(self.run())
+        try:
+            async for event in stream:
+                yield event
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
@@ -0,0 +1,407 @@
+"""
+Performance benchmarks of the mass update utility. By default the
+benchmarks run against the local broker simulator (see simulator.py),
+with --live they run against the broker from the configuration file
+
+    python benchmark.py connections [-c CONFIGURATION_FILE] [--live] [-r REPEATS]
+    python benchmark.py rollout [-c CONFIGURATION_FILE] [simulator options]
+    python benchmark.py filters [--controllers N] [-r REPEATS]
+    python benchmark.py frames [-r REPEATS]
+    python benchmark.py inventory [--controllers N]
+"""
+from argparse import ArgumentParser, Namespace
+import asyncio
+from contextlib import contextmanager, redirect_stdout
+from copy import deepcopy
+from dataclasses import dataclass, fields, replace
+from itertools import chain
+import json
+from os import devnull, listdir, path as os_path
+import re
+import resource
+import subprocess
+import sys
+from tempfile import mkdtemp
+import time
+import tracemalloc
+from typing import Generator
+
+from yaml import load, FullLoader
+
+from actions import GetControllers, ValidateControllers
+from config_produser import ConfigProdiser
+from connections import build_connections
+from core import colors
+from dtos import Config, ControllerStatus, WebsocketsConfig
+from filters import ControllerFilter
+from frames import Frame, JSON_BACKEND
+from inventory import Inventory, iter_controllers
+from main import App
+from simulator import FINISHED_FEEDBACK, SimulatorConfig
+from simulator import add_arguments as add_simulator_arguments
+from writer import ReportWriter
+
+
+def quiet_config(config: Config) -> Config:
+    """
+    Copy of the config, that writes reports to the temporary directory
+    """
+    config = deepcopy(config)
+    config.report_writer = replace(config.report_writer,
+                                   report_dir_path=mkdtemp(),
+                                   is_absolute_path=True)
+    return config
+
+
+@contextmanager
+def simulated_broker(args: Namespace) -> Generator[str, None, None]:
+    """
+    Run the broker simulator in the subprocess. Yields its url
+    """
+    command = [sys.executable,
+               os_path.join(os_path.dirname(__file__), "simulator.py"),
+               "-p", "0"]
+    for f in fields(SimulatorConfig):
+        name = f"--{f.name.replace("_", "-")}"
+        value = getattr(args, f.name)
+        if isinstance(f.default, bool):
+            # bool options are flags
+            if value:
+                command.append(name)
+            continue
+        command += [name, str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    try:
+        line = process.stdout.readline()
+        if not line.startswith("Listening on"):
+            raise RuntimeError("Broker simulator failed to start")
+        yield line.split()[-1]
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@contextmanager
+def benchmark_config(args: Namespace) -> Generator[Config, None, None]:
+    if args.config:
+        config = ConfigProdiser.read_config_file(args.config)
+    else:
+        config = Config(
+            websockets=WebsocketsConfig(login="benchmark", password="benchmark"),
+            software_build_url="http://127.0.0.1/simplehome.zip",
+            file_service_token="benchmark")
+    config = quiet_config(config)
+    if args.live:
+        yield config
+        return
+    with simulated_broker(args) as url:
+        config.websockets.url = url
+        config.actions.update.finished_feedback = [FINISHED_FEEDBACK]
+        yield config
+
+
+class ResourceSampler:
+    """
+    Samples the number of open file descriptors of the process
+    """
+
+    def __init__(self, interval: float = .1) -> None:
+        self.interval = interval
+        self.peak_fds = 0
+        self.task: asyncio.Task | None = None
+
+    @staticmethod
+    def open_fds() -> int:
+        try:
+            return len(listdir("/proc/self/fd"))
+        except OSError:
+            return 0
+
+    async def __sample(self):
+        while True:
+            self.peak_fds = max(self.peak_fds, self.open_fds())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.task = asyncio.create_task(self.__sample())
+
+    def stop(self):
+        self.task.cancel()
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def bench_connections(config: Config, repeats: int):
+    """
+    Compare validation throughput of the direct and
+    the multiplexed connection modes
+    """
+    config.report_writer.detail_report = False
+    writer = ReportWriter(config.report_writer)
+    with open(devnull, "w") as null, redirect_stdout(null):
+        controllers = await GetControllers(config, writer).run()
+    print(len(controllers), "controllers available")
+    for mode in ("direct", "multiplexed"):
+        mode_config = deepcopy(config)
+        mode_config.websockets.connection_mode = mode
+        timings = []
+        for _ in range(repeats):
+            connections = build_connections(mode_config)
+            start = time.perf_counter()
+            try:
+                with open(devnull, "w") as null, redirect_stdout(null):
+                    validator = ValidateControllers(mode_config, writer,
+                                                    connections)
+                    validator.confirmed = True
+                    approved = await validator.run(controllers)
+            finally:
+                await connections.close()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(colors.blue(mode),
+              f"best {best:.2f}s",
+              f"{len(controllers) / best:.1f} controllers/s",
+              f"{len(approved)} approved")
+    writer.close()
+
+
+async def bench_rollout(config: Config):
+    """
+    Run App.run_actions end to end
+    """
+    app = App(config, confirmed=True)
+    sampler = ResourceSampler()
+    sampler.start()
+    start = time.perf_counter()
+    with open(devnull, "w") as null, redirect_stdout(null):
+        await app.run_actions()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+    with open(os_path.join(app.writer.dir_path,
+                           "controllers_states.yaml")) as file:
+        states = load(file, Loader=FullLoader)
+    available = states.get("total_available", 0)
+    print(f"wall time {elapsed:.2f}s",
+          f"throughput {available / elapsed:.1f} controllers/s",
+          f"peak RSS {peak_rss_mb():.1f} MB",
+          f"peak open fds {sampler.peak_fds}",
+          f"report {app.writer.dir_path}",
+          sep="\n")
+
+
+def legacy_filter(
+    config: Config,
+    controllers: list[ControllerStatus],
+) -> Generator[ControllerStatus, None, None]:
+    """
+    GetControllers.filter_controllers before the ControllerFilter
+    """
+    if config.controllers_whitelist:
+        controllers_uid = [c2.uid for c2 in controllers]
+        controllers_gen = chain(
+            (c for c in controllers if c.uid in config.controllers_whitelist),
+            (
+                ControllerStatus(uid=c, status="offline")
+                for c in config.controllers_whitelist
+                if c not in controllers_uid
+            ),
+        )
+    else:
+        controllers_gen = (c for c in controllers
+                           if c.uid not in config.controllers_blacklist)
+    if config.controller_uid_regex:
+        pattern = re.compile(config.controller_uid_regex)
+        controllers_gen = (c for c in controllers_gen if pattern.fullmatch(c.uid))
+    return controllers_gen
+
+
+def bench_filters(count: int, repeats: int):
+    """
+    Compare the legacy list-based filter with the ControllerFilter.
+    Half of the whitelist is missing in the controllers list
+    """
+    controllers = [ControllerStatus(uid=f"wirenboard-{i:08X}", status="online")
+                   for i in range(count)]
+    config = Config(
+        websockets=WebsocketsConfig(login="benchmark", password="benchmark"),
+        software_build_url="http://127.0.0.1/simplehome.zip",
+        file_service_token="benchmark",
+        controllers_whitelist=[f"wirenboard-{i:08X}"
+                               for i in range(count // 2, count + count // 2)],
+        controller_uid_regex="wirenboard-[A-Z0-9]{8}")
+    implementations = {
+        "legacy": lambda: legacy_filter(config, controllers),
+        "filter": lambda: ControllerFilter.from_config(config).filter(controllers),
+    }
+    for name, func in implementations.items():
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            selected = sum(1 for _ in func())
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(colors.blue(name),
+              f"best {best:.3f}s",
+              f"{count / best:.0f} controllers/s",
+              f"{selected} selected")
+
+
+def sample_frames(count: int) -> list[str]:
+    """
+    Update stream: mostly progress, some foreign and final frames
+    """
+    frames = []
+    for i in range(count):
+        uid = f"wirenboard-{i % 500:08X}"
+        if i % 20 == 0:
+            message = {"action": "admin_subscribe", "uid": uid,
+                       "status": "subscribed"}
+        elif i % 20 == 1:
+            message = {"action": "updater_feedback",
+                       "feedback_type": "update_finished", "uid": uid,
+                       "versions": {"simplehome": "1.0", "sh-updater": "1.0"}}
+        else:
+            message = {"action": "updater_feedback",
+                       "feedback_type": "update_progress", "uid": uid,
+                       "progress": i % 100, "stage": "downloading"}
+        frames.append(json.dumps(message))
+    return frames
+
+
+def bench_frames(repeats: int, count: int = 200_000):
+    """
+    Compare frames/s of the single core classifying update frames
+    with the full json decoding and with the Frame
+    """
+    def legacy(raw: str):
+        resp = json.loads(raw)
+        if resp.get("action") != "updater_feedback":
+            return
+        if resp.get("feedback_type") == "update_progress":
+            return
+        return resp
+
+    def frame(raw: str):
+        frame = Frame(raw)
+        if not frame.matches("action", "updater_feedback"):
+            return
+        if frame.matches("feedback_type", "update_progress"):
+            return
+        return frame.data
+
+    frames = sample_frames(count)
+    print("json backend:", JSON_BACKEND)
+    for name, func in {"legacy": legacy, "frame": frame}.items():
+        timings = []
+        for _ in range(repeats):
+            start = time.process_time()
+            final = sum(1 for raw in frames if func(raw) is not None)
+            timings.append(time.process_time() - start)
+        best = min(timings)
+        print(colors.blue(name),
+              f"best {best:.3f}s",
+              f"{count / best:.0f} frames/s per core",
+              f"{final} final frames")
+
+
+@dataclass
+class LegacyControllerStatus:
+    uid: str
+    status: str
+
+
+def legacy_inventory(raw: str, config: Config) -> list:
+    """
+    GetControllers.run before the streaming Inventory
+    """
+    controllers_states = {"online": [], "inactive": [], "offline": []}
+    result = []
+    controllers = [LegacyControllerStatus(**c)
+                   for c in json.loads(raw)["controllers"]]
+    for cont in legacy_filter(config, controllers):
+        match cont.status:
+            case "online":
+                controllers_states["online"].append(cont.uid)
+                result.append(cont)
+            case "inactive":
+                controllers_states["inactive"].append(cont.uid)
+                result.append(cont)
+            case _:
+                controllers_states["offline"].append(cont.uid)
+    return [controllers_states, result]
+
+
+def bench_inventory(count: int):
+    """
+    Compare peak memory and time of the get_all_controllers reply
+    processing by the legacy code and the Inventory
+    """
+    statuses = ("online", "online", "online", "inactive", "offline")
+    raw = json.dumps({
+        "action": "get_all_controllers",
+        "uid": "null",
+        "controllers": [{"uid": f"wirenboard-{i:08X}",
+                         "status": statuses[i % len(statuses)]}
+                        for i in range(count)],
+    })
+    config = Config(
+        websockets=WebsocketsConfig(login="benchmark", password="benchmark"),
+        software_build_url="http://127.0.0.1/simplehome.zip",
+        file_service_token="benchmark",
+        controller_uid_regex="wirenboard-[A-Z0-9]{8}")
+    controller_filter = ControllerFilter.from_config(config)
+    implementations = {
+        "legacy": lambda: legacy_inventory(raw, config),
+        "inventory": lambda: Inventory.from_controllers(
+            controller_filter.filter(iter_controllers(raw))),
+    }
+    print(f"reply {len(raw) / 2 ** 20:.1f} MB")
+    for name, func in implementations.items():
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        del result
+        tracemalloc.start()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        print(colors.blue(name),
+              f"{elapsed:.2f}s",
+              f"peak {peak / 2 ** 20:.1f} MB")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=["connections", "rollout", "filters",
+                                                 "frames", "inventory"])
+    parser.add_argument("-c", dest="config",
+                        help="yaml configuration file")
+    parser.add_argument("--live", action="store_true",
+                        help="use the broker from the configuration file")
+    parser.add_argument("-r", dest="repeats", type=int, default=3)
+    add_simulator_arguments(parser)
+    args = parser.parse_args()
+    if args.live and not args.config:
+        parser.error("--live requires -c")
+    if args.benchmark == "filters":
+        bench_filters(args.controllers, args.repeats)
+        return
+    if args.benchmark == "frames":
+        bench_frames(args.repeats)
+        return
+    if args.benchmark == "inventory":
+        bench_inventory(args.controllers)
+        return
+    with benchmark_config(args) as config:
+        match args.benchmark:
+            case "connections":
+                asyncio.run(bench_connections(config, args.repeats))
+            case "rollout":
+                asyncio.run(bench_rollout(config))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+from copy import deepcopy
+from dataclasses import replace
+from os import path as os_path
+
+from yaml import load, FullLoader
+
+from dtos import BrokerConfig, Config
+from shards import SHARD_SUMMARIES, merge_reports
+from writer import ReportWriter
+
+# filters of the broker, that override the global ones
+BROKER_FILTERS = (
+    "controllers_whitelist", "controllers_blacklist",
+    "controller_uid_regex", "controller_uid_regexes",
+    "controller_uid_exclude_regexes",
+    "controllers_whitelist_file", "controllers_blacklist_file",
+)
+
+
+def broker_config(config: Config, broker: BrokerConfig) -> Config:
+    """
+    Config of the single broker run: global settings with the broker
+    overrides applied
+    """
+    config = deepcopy(config)
+    config.brokers = []
+    config.websockets = replace(config.websockets, **broker.websockets)
+    if broker.file_service_token is not None:
+        config.file_service_token = broker.file_service_token
+    for name in BROKER_FILTERS:
+        value = getattr(broker, name)
+        if value is not None:
+            setattr(config, name, value)
+    if broker.max_pool_size is not None:
+        config.max_pool_size = broker.max_pool_size
+        for action in (config.actions.validate, config.actions.update):
+            action.max_pool_size = min(
+                action.max_pool_size or broker.max_pool_size,
+                broker.max_pool_size)
+        concurrency = config.actions.update.adaptive_concurrency
+        concurrency.max_pool_size = min(concurrency.max_pool_size,
+                                        broker.max_pool_size)
+    # results of the brokers get to the history with the merged journal
+    config.report_writer.history = False
+    return config
+
+
+def broker_summary(dir_path: str) -> dict:
+    """
+    Totals of the summaries in the report directory of the broker
+    """
+    summary = {}
+    for file_name in SHARD_SUMMARIES:
+        file_path = os_path.join(dir_path, file_name)
+        if not os_path.exists(file_path):
+            continue
+        with open(file_path) as file:
+            data = load(file, Loader=FullLoader) or {}
+        summary.update({k: v for k, v in data.items()
+                        if k.startswith("total_")})
+    return summary
+
+
+def merge_brokers(writer: ReportWriter, broker_dirs: dict[str, str],
+                  errors: dict[str, str]):
+    """
+    Merge reports of the brokers into the report directory of the writer
+    and save totals per broker to brokers.yaml
+    """
+    merge_reports(writer, list(broker_dirs.values()))
+    brokers = {}
+    for name, dir_path in broker_dirs.items():
+        brokers[name] = broker_summary(dir_path)
+        if name in errors:
+            brokers[name]["error"] = errors[name]
+    writer.write_yaml_file(file_name="brokers.yaml",
+                           data={"brokers": brokers})
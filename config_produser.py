@@ -27,6 +27,40 @@ class ConfigProdiser:
         except IndexError:
             print(colors.yellow("Build url was not provided"))
 
+    @classmethod
+    def get_resume_dir(cls) -> str | None:
+        """
+        Report directory of the interrupted run, provided with `--resume`
+        """
+        try:
+            c = sys.argv.index("--resume")
+            return sys.argv[c+1]
+        except ValueError:
+            return
+        except IndexError:
+            print(colors.yellow("Report directory to resume was not provided"))
+
+    @classmethod
+    def get_workers(cls) -> int:
+        """
+        Number of the worker processes, provided with `--workers`
+        """
+        try:
+            c = sys.argv.index("--workers")
+            return max(int(sys.argv[c+1]), 1)
+        except ValueError:
+            return 1
+        except IndexError:
+            print(colors.yellow("Number of workers was not provided"))
+            return 1
+
+    @classmethod
+    def is_plan(cls) -> bool:
+        """
+        Return True, if `--plan` was provided as command attribute
+        """
+        return "--plan" in sys.argv
+
     @classmethod
     @cache
     def already_confirmed(cls) -> bool:
@@ -0,0 +1,312 @@
+from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import json
+import time
+from typing import AsyncIterator
+
+from websockets import connect
+from websockets.asyncio.client import ClientConnection
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+from websockets.protocol import State
+
+from core import get_auth_header
+from dtos import Config
+from events import EventBus, Notice
+from frames import Frame
+
+
+class BrokerSession(ABC):
+    """
+    Channel to the broker bound to the single controller uid
+    """
+
+    # frames of the controller reach the session only after admin_subscribe
+    requires_subscribe = False
+
+    def __init__(self, uid: str) -> None:
+        self.uid = uid
+        # admin_subscribe was sent over the session
+        self.subscribed = False
+
+    @abstractmethod
+    async def send(self, message: dict):
+        ...
+
+    @abstractmethod
+    async def recv(self) -> str:
+        """
+        Return next raw frame addressed to the controller
+        """
+
+
+class DirectSession(BrokerSession):
+    def __init__(self, uid: str, websocket: ClientConnection) -> None:
+        super().__init__(uid)
+        self.websocket = websocket
+
+    async def send(self, message: dict):
+        await self.websocket.send(json.dumps(message))
+
+    async def recv(self) -> str:
+        return await self.websocket.recv()
+
+
+class MultiplexedSession(BrokerSession):
+    requires_subscribe = True
+
+    def __init__(self, uid: str, connection: "SharedConnection") -> None:
+        super().__init__(uid)
+        self.connection = connection
+        self.queue: asyncio.Queue[str | Exception] = asyncio.Queue()
+
+    async def send(self, message: dict):
+        await self.connection.websocket.send(json.dumps(message))
+
+    async def recv(self) -> str:
+        frame = await self.queue.get()
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+
+class SharedConnection:
+    """
+    Persistent broker connection. Incoming frames are routed
+    to the sessions by the `uid` field. The broker sends frames of the
+    controllers, that were subscribed over this connection
+    """
+
+    def __init__(self, websocket: ClientConnection) -> None:
+        self.websocket = websocket
+        self.sessions: dict[str, MultiplexedSession] = {}
+        # uids, that admin_subscribe was sent for
+        self.subscribed: set[str] = set()
+        self.closed: Exception | None = None
+        self.reader = asyncio.create_task(self.__read())
+
+    async def __read(self):
+        try:
+            async for frame in self.websocket:
+                try:
+                    uid = Frame(frame).get("uid")
+                except ValueError:
+                    continue
+                session = self.sessions.get(uid)
+                if session is not None:
+                    session.queue.put_nowait(frame)
+        except ConnectionClosed as e:
+            self.closed = e
+        else:
+            self.closed = ConnectionError("Broker connection closed")
+        for session in self.sessions.values():
+            session.queue.put_nowait(self.closed)
+
+    def attach(self, uid: str) -> MultiplexedSession:
+        if self.closed is not None:
+            raise self.closed
+        if uid in self.sessions:
+            raise RuntimeError(f"Session for {uid} already opened")
+        session = MultiplexedSession(uid, connection=self)
+        session.subscribed = uid in self.subscribed
+        self.sessions[uid] = session
+        return session
+
+    def detach(self, uid: str):
+        session = self.sessions.pop(uid, None)
+        if session is not None and session.subscribed:
+            self.subscribed.add(uid)
+
+    async def close(self):
+        await self.websocket.close()
+        await self.reader
+
+
+class ConnectionsAbc(ABC):
+    def __init__(self, config: Config,
+                 events: EventBus | None = None) -> None:
+        self.config = config
+        self.events = events or EventBus.console()
+        self.headers = {"Authorization": get_auth_header(config)}
+
+    @abstractmethod
+    def open(self, uid: str, hold: bool = False) -> AsyncIterator[BrokerSession]:
+        """
+        Async context manager, that yields session for the controller.
+        If `hold` is True, the session may be kept open after the exit
+        and yielded by the next open() of the same controller
+        """
+
+    async def release(self, uid: str):
+        """
+        Close the held session of the controller
+        """
+
+    async def close(self):
+        ...
+
+
+class DirectConnections(ConnectionsAbc):
+    """
+    Opens the dedicated websocket connection for every controller.
+    With `websockets.session_reuse` held sessions are kept for the
+    next phase, up to `websockets.max_held_sessions` and no longer
+    than `websockets.session_idle_timeout` seconds. Above the limit
+    new sessions are not held, so the sessions of the controllers
+    validated first, which are updated first, are kept
+    """
+
+    def __init__(self, config: Config,
+                 events: EventBus | None = None) -> None:
+        super().__init__(config, events)
+        # held sessions and the time they were held, oldest first
+        self.held: OrderedDict[str, tuple[DirectSession, float]] = OrderedDict()
+        # closes idle held sessions, while no sessions are opened
+        self.evictor: asyncio.Task | None = None
+
+    async def __connect(self, uid: str) -> DirectSession:
+        url = self.config.websockets.build_url(uid, client_id=f"{uid}_worker")
+        websocket = await connect(url, additional_headers=self.headers)
+        return DirectSession(uid, websocket=websocket)
+
+    async def __take(self, uid: str) -> DirectSession | None:
+        session, _ = self.held.pop(uid, (None, None))
+        if session is None:
+            return
+        if session.websocket.state is not State.OPEN:
+            await session.websocket.close()
+            return
+        return session
+
+    async def evict(self):
+        """
+        Close sessions held longer than the idle timeout
+        """
+        now = time.monotonic()
+        while self.held:
+            uid, (session, held_at) = next(iter(self.held.items()))
+            if now - held_at < self.config.websockets.session_idle_timeout:
+                break
+            del self.held[uid]
+            await session.websocket.close()
+
+    async def __evict_idle(self):
+        timeout = self.config.websockets.session_idle_timeout
+        while self.held:
+            _, held_at = next(iter(self.held.values()))
+            await asyncio.sleep(held_at + timeout - time.monotonic())
+            await self.evict()
+
+    def __hold(self, uid: str, session: DirectSession) -> bool:
+        if len(self.held) >= self.config.websockets.max_held_sessions:
+            return False
+        self.held[uid] = (session, time.monotonic())
+        if self.evictor is None or self.evictor.done():
+            self.evictor = asyncio.create_task(self.__evict_idle())
+        return True
+
+    @asynccontextmanager
+    async def open(self, uid: str, hold: bool = False) -> AsyncIterator[BrokerSession]:
+        await self.evict()
+        session = await self.__take(uid) or await self.__connect(uid)
+        try:
+            yield session
+        except BaseException:
+            await session.websocket.close()
+            raise
+        if not (hold and self.config.websockets.session_reuse
+                and self.__hold(uid, session)):
+            await session.websocket.close()
+
+    async def release(self, uid: str):
+        session, _ = self.held.pop(uid, (None, None))
+        if session is not None:
+            await session.websocket.close()
+
+    async def close(self):
+        if self.evictor is not None:
+            self.evictor.cancel()
+        held, self.held = self.held, OrderedDict()
+        for session, _ in held.values():
+            await session.websocket.close()
+
+
+class MultiplexedConnections(ConnectionsAbc):
+    """
+    Keeps `websockets.pool_connections` persistent connections and
+    serves many controllers over each of them. The controller is pinned
+    to the connection, that it was subscribed over. Falls back to the
+    dedicated connections if the broker refuses the shared ones
+    """
+
+    def __init__(self, config: Config,
+                 events: EventBus | None = None) -> None:
+        super().__init__(config, events)
+        self.size = max(config.websockets.pool_connections, 1)
+        self.connections: list[SharedConnection] = []
+        self.fallback: DirectConnections | None = None
+        self.lock = asyncio.Lock()
+
+    async def __connect(self, index: int) -> SharedConnection:
+        url = self.config.websockets.build_url(
+            "null", client_id=f"mass_update_{index}")
+        websocket = await connect(url, additional_headers=self.headers)
+        return SharedConnection(websocket)
+
+    async def __acquire(self, uid: str) -> SharedConnection | None:
+        async with self.lock:
+            if self.fallback is not None:
+                return
+            self.connections = [c for c in self.connections
+                                if c.closed is None]
+            for connection in self.connections:
+                if uid in connection.subscribed:
+                    return connection
+            if len(self.connections) < self.size:
+                try:
+                    self.connections.append(
+                        await self.__connect(len(self.connections)))
+                except (InvalidHandshake, OSError) as e:
+                    if not self.connections:
+                        self.events.emit(Notice(
+                            f"Shared broker connection refused ({e}). "
+                            "Fall back to per controller connections.",
+                            level="warning"))
+                        self.fallback = DirectConnections(self.config,
+                                                          self.events)
+                        return
+            return min(self.connections, key=lambda c: len(c.sessions))
+
+    @asynccontextmanager
+    async def open(self, uid: str, hold: bool = False) -> AsyncIterator[BrokerSession]:
+        connection = await self.__acquire(uid)
+        if connection is None:
+            async with self.fallback.open(uid, hold=hold) as session:
+                yield session
+            return
+        session = connection.attach(uid)
+        try:
+            yield session
+        finally:
+            connection.detach(uid)
+
+    async def release(self, uid: str):
+        if self.fallback is not None:
+            await self.fallback.release(uid)
+
+    async def close(self):
+        connections, self.connections = self.connections, []
+        for connection in connections:
+            await connection.close()
+        if self.fallback is not None:
+            await self.fallback.close()
+
+
+def build_connections(config: Config,
+                      events: EventBus | None = None) -> ConnectionsAbc:
+    match config.websockets.connection_mode:
+        case "multiplexed":
+            return MultiplexedConnections(config, events)
+        case _:
+            return DirectConnections(config, events)
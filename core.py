@@ -1,5 +1,9 @@
+import asyncio
 import base64
 import json
+import os
+import sys
+from threading import Thread
 from typing import Any
 
 from dtos import Config
@@ -44,3 +48,44 @@ def get_auth_header(config: Config) -> str:
         .format(login, password)
         .encode("ascii")).decode("ascii")
     return "Basic {}".format(token)
+
+
+def read_line() -> str:
+    """
+    Read the line from stdin bypassing its buffer, so the reading thread
+    holds no locks, that the interpreter needs on exit
+    """
+    line = bytearray()
+    while (char := os.read(sys.stdin.fileno(), 1)) != b"\n":
+        if not char:
+            if not line:
+                raise EOFError("EOF when reading a line")
+            break
+        line += char
+    return line.decode()
+
+
+async def ainput(prompt: str = "") -> str:
+    """
+    input(), that doesn't block the event loop: connections and timers
+    of the run keep working while the user answers
+    """
+    loop = asyncio.get_running_loop()
+    answer = loop.create_future()
+
+    def settle(method: Any, value: Any):
+        if not answer.done():
+            method(value)
+
+    def read():
+        try:
+            line = read_line()
+        except Exception as e:
+            loop.call_soon_threadsafe(settle, answer.set_exception, e)
+            return
+        loop.call_soon_threadsafe(settle, answer.set_result, line)
+
+    print(prompt, end="", flush=True)
+    # daemon thread doesn't keep the process alive after Ctrl+C
+    Thread(target=read, daemon=True).start()
+    return await answer
@@ -0,0 +1,134 @@
+import asyncio
+from contextlib import asynccontextmanager
+import time
+from typing import AsyncIterator
+
+from dtos import DownloadsConfig
+from frames import Frame
+
+
+class TokenBucket:
+    """
+    Tokens are refilled at `rate` per second up to `capacity`
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self, amount: float):
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self.__refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self.__refill()
+            self.tokens -= amount
+
+
+class DownloadSlot:
+    """
+    Download phase of the single update. Released as soon as the
+    progress feedback shows the build is downloaded
+    """
+
+    def __init__(self, slots: "DownloadSlots | None" = None) -> None:
+        self.slots = slots
+        self.started = time.monotonic()
+
+    @property
+    def held(self) -> bool:
+        return self.slots is not None
+
+    def feed(self, frame: Frame):
+        """
+        Release the slot, if the progress frame ends the download
+        """
+        if self.held and self.slots.is_downloaded(frame):
+            self.release(reason="progress")
+
+    def release(self, reason: str = "finished"):
+        if not self.held:
+            return
+        slots, self.slots = self.slots, None
+        slots.free(reason, duration=time.monotonic() - self.started)
+
+
+class DownloadSlots:
+    """
+    Limits the number of the controllers downloading the build at once,
+    apart from the number of the running updates. With `bandwidth_mb`
+    the starts of the downloads are also limited by the token bucket
+    """
+
+    def __init__(self, config: DownloadsConfig) -> None:
+        self.config = config
+        self.semaphore = asyncio.Semaphore(max(config.max_downloads, 1))
+        self.bucket: TokenBucket | None = None
+        if config.bandwidth_mb and config.build_size_mb:
+            self.bucket = TokenBucket(
+                rate=config.bandwidth_mb,
+                capacity=max(config.bandwidth_mb, config.build_size_mb))
+        self.active = 0
+        self.stats = {"peak_downloads": 0, "released_by_progress": 0,
+                      "released_at_end": 0, "total_download_time": 0.0}
+
+    def is_downloaded(self, frame: Frame) -> bool:
+        stage = frame.get(self.config.stage_field)
+        if stage is not None and stage in self.config.done_stages:
+            return True
+        progress = frame.get(self.config.progress_field)
+        return (isinstance(progress, (int, float))
+                and not isinstance(progress, bool)
+                and progress >= self.config.done_progress)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[DownloadSlot]:
+        if not self.config.enabled:
+            yield DownloadSlot()
+            return
+        await self.semaphore.acquire()
+        try:
+            if self.bucket is not None:
+                await self.bucket.take(self.config.build_size_mb)
+        except BaseException:
+            self.semaphore.release()
+            raise
+        self.active += 1
+        self.stats["peak_downloads"] = max(self.stats["peak_downloads"],
+                                           self.active)
+        slot = DownloadSlot(self)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def free(self, reason: str, duration: float):
+        self.active -= 1
+        self.semaphore.release()
+        if reason == "progress":
+            self.stats["released_by_progress"] += 1
+            self.stats["total_download_time"] += duration
+        else:
+            self.stats["released_at_end"] += 1
+
+    def summary(self) -> dict:
+        released = self.stats["released_by_progress"]
+        return {
+            "max_downloads": self.config.max_downloads,
+            "peak_downloads": self.stats["peak_downloads"],
+            "released_by_progress": released,
+            "released_at_end": self.stats["released_at_end"],
+            "mean_download_time": round(
+                self.stats["total_download_time"] / released, 3)
+            if released else None,
+        }
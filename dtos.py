@@ -9,6 +9,20 @@ class WebsocketsConfig(YAMLObject):
     login: str = field(repr=False)
     password: str = field(repr=False)
     url: str = "wss://dev.cloud.simple-home.liis.su"
+    # "direct" - connection per controller, "multiplexed" - shared connections
+    connection_mode: Literal["direct", "multiplexed"] = "direct"
+    # number of shared connections in "multiplexed" mode
+    pool_connections: int = 4
+    # keep connections of the validated controllers for the update
+    session_reuse: bool = False
+    # limit of the kept connections and seconds they are kept for
+    max_held_sessions: int = 1000
+    session_idle_timeout: float = 300
+    # "delay" - wait subscribe_delay after admin_subscribe, "ack" - wait
+    # for the acknowledgement of the broker no longer than subscribe_delay,
+    # "pipeline" - send the command at once, the broker keeps the order
+    subscribe_handshake: Literal["delay", "ack", "pipeline"] = "delay"
+    subscribe_delay: float = .2
 
     def build_url(self, controller_uid: str, path: str = "ws/admin", **kwargs):
         url = f"{sys_path.join(self.url, path)}?uid={controller_uid}"
@@ -22,6 +36,22 @@ class ReportConfig(YAMLObject):
     report_dir_path: str = field(default_factory=getcwd)
     is_absolute_path: bool = True
     detail_report: bool = True
+    # "text" - file per controller, "eventlog" - single log with the index
+    report_format: Literal["text", "eventlog"] = "text"
+    # write detail report in the background thread
+    async_writes: bool = False
+    # settings of the background writer
+    max_open_files: int = 64
+    flush_interval: float = 1.0
+    max_buffered_bytes: int = 16 * 1024 * 1024
+    # fsync the progress journal after every record
+    journal_fsync: bool = False
+    # save per-controller step latencies to metrics.json and metrics.prom
+    metrics: bool = False
+    # seconds between samples of the executor load
+    metrics_sample_interval: float = 1.0
+    # save results to the history.sqlite in report_dir_path
+    history: bool = False
 
     def build_report_dir_path(self) -> str:
         if self.is_absolute_path:
@@ -29,54 +59,224 @@ class ReportConfig(YAMLObject):
         return sys_path.join(getcwd(), self.report_dir_path)
 
 
+@dataclass
+class RetryConfig(YAMLObject):
+    # total number of attempts, 1 - no retries
+    attempts: int = 1
+    # seconds, backoff of the first retry. Doubles with every next retry
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    # failures that are retried: "connect", "timeout", "error"
+    retry_on: list[str] = field(default_factory=lambda: ["connect", "timeout"])
+
+
 @dataclass
 class BaseActionConfig(YAMLObject):
     timeout: int = 10
     enabled: bool = True
+    # overrides global max_pool_size for the action
+    max_pool_size: int | None = None
+    retry: RetryConfig = field(default_factory=RetryConfig)
+
+    def __post_init__(self):
+        if isinstance(self.retry, dict):
+            self.retry = RetryConfig(**self.retry)
+
+
+@dataclass
+class ValidateActionConfig(BaseActionConfig):
+    # seconds, during which cached controller versions are used
+    # instead of the request. 0 - cache is disabled
+    version_cache_ttl: int = 0
+
+
+@dataclass
+class AdaptiveConcurrencyConfig(YAMLObject):
+    enabled: bool = False
+    # floor and ceiling of the number of controllers processed at the same time
+    min_pool_size: int = 1
+    max_pool_size: int = 50
+    # initial number of controllers processed at the same time, min_pool_size by default
+    initial_pool_size: int | None = None
+    increase_step: int = 1
+    decrease_factor: float = 0.5
+    # seconds. Slower successful results don't increase concurrency
+    max_latency: float | None = None
+
+
+@dataclass
+class WavesConfig(YAMLObject):
+    enabled: bool = False
+    # cumulative shares of the controllers updated by the end of every wave
+    sizes: list[float] = field(default_factory=lambda: [0.01, 0.1, 1.0])
+    # rollout stops, if share of failed controllers in the wave exceeds it
+    max_failure_ratio: float = 0.1
+    min_wave_size: int = 1
+
+
+@dataclass
+class DownloadsConfig(YAMLObject):
+    enabled: bool = False
+    # controllers downloading the build at once
+    max_downloads: int = 10
+    # download is finished, when the progress reaches done_progress
+    # or the stage of the progress frame is one of done_stages
+    progress_field: str = "progress"
+    done_progress: float = 100
+    stage_field: str = "stage"
+    done_stages: list[str] = field(default_factory=list)
+    # aggregate bandwidth and size of the build, MB. Both are required
+    # to limit the start of the downloads by the token bucket
+    bandwidth_mb: float | None = None
+    build_size_mb: float | None = None
+
+
+@dataclass
+class AdaptiveTimeoutConfig(YAMLObject):
+    enabled: bool = False
+    # deadline of the update is percentile of the previous durations * factor
+    percentile: float = 95
+    factor: float = 2.0
+    # durations required to derive the deadline of the controller
+    min_samples: int = 5
+    # seconds, bounds of the derived deadline
+    min_timeout: float = 30
+    max_timeout: float | None = None
+    # number of the last reports to read the durations from
+    history_runs: int = 20
+
+
+@dataclass
+class PriorityConfig(YAMLObject):
+    enabled: bool = False
+    # "explicit", "online", "longest" in the order of importance
+    policies: list[str] = field(
+        default_factory=lambda: ["explicit", "online", "longest"])
+    # controllers updated first, in this order
+    uids: list[str] = field(default_factory=list)
+    # number of the last reports to read the update durations from
+    history_runs: int = 20
 
 
 @dataclass
 class UpdateActionConfig(BaseActionConfig):
     timeout: int = 5*60
+    adaptive_concurrency: AdaptiveConcurrencyConfig = field(
+        default_factory=AdaptiveConcurrencyConfig)
+    waves: WavesConfig = field(default_factory=WavesConfig)
+    downloads: DownloadsConfig = field(default_factory=DownloadsConfig)
+    # seconds without update_progress feedback before the update fails
+    stall_timeout: float | None = None
+    # feedback types of the broker, that finish the update successfully.
+    # Other feedback types except "error" are ignored. Without them the
+    # update finishes only with the error or the timeout
+    finished_feedback: list[str] = field(default_factory=list)
+    adaptive_timeout: AdaptiveTimeoutConfig = field(
+        default_factory=AdaptiveTimeoutConfig)
+    priority: PriorityConfig = field(default_factory=PriorityConfig)
+
+    def __post_init__(self):
+        super().__post_init__()
+        if isinstance(self.adaptive_concurrency, dict):
+            self.adaptive_concurrency = AdaptiveConcurrencyConfig(
+                **self.adaptive_concurrency)
+        if isinstance(self.waves, dict):
+            self.waves = WavesConfig(**self.waves)
+        if isinstance(self.downloads, dict):
+            self.downloads = DownloadsConfig(**self.downloads)
+        if isinstance(self.adaptive_timeout, dict):
+            self.adaptive_timeout = AdaptiveTimeoutConfig(
+                **self.adaptive_timeout)
+        if isinstance(self.priority, dict):
+            self.priority = PriorityConfig(**self.priority)
 
 
 @dataclass
 class ActionsConfig(YAMLObject):
-    validate: BaseActionConfig = field(default_factory=BaseActionConfig)
+    validate: ValidateActionConfig = field(default_factory=ValidateActionConfig)
     update: UpdateActionConfig = field(default_factory=UpdateActionConfig)
 
     def __post_init__(self):
         if isinstance(self.validate, dict):
-            self.validate = BaseActionConfig(**self.validate)
+            self.validate = ValidateActionConfig(**self.validate)
         if isinstance(self.update, dict):
             self.update = UpdateActionConfig(**self.update)
 
 
+@dataclass
+class InventoryConfig(YAMLObject):
+    # save the controllers statuses to the inventory cache after every run
+    cache: bool = False
+    # validate only new controllers and controllers, which status changed
+    # since the last run. Others are decided by the cached versions
+    incremental: bool = False
+
+
+@dataclass
+class BrokerConfig(YAMLObject):
+    # name of the broker, also the subdirectory of its report
+    name: str
+    # overrides of the global websockets settings, e.g. url and credentials
+    websockets: dict[str, Any] = field(default_factory=dict)
+    file_service_token: str | None = None
+    # overrides global and actions max_pool_size for the broker
+    max_pool_size: int | None = None
+    # overrides of the global filters
+    controllers_whitelist: set[str] | None = None
+    controllers_blacklist: set[str] | None = None
+    controller_uid_regex: str | None = None
+    controller_uid_regexes: list[str] | None = None
+    controller_uid_exclude_regexes: list[str] | None = None
+    controllers_whitelist_file: str | None = None
+    controllers_blacklist_file: str | None = None
+
+
 @dataclass
 class Config(YAMLObject):
     websockets: WebsocketsConfig
     software_build_url: str
     file_service_token: str
+    # version of the build. Controllers with this version are not updated
+    software_version: str | None = None
+    # name of the software in the controller versions list
+    software_name: str = "simplehome"
     report_writer: ReportConfig = field(default_factory=ReportConfig)
     actions: ActionsConfig = field(default_factory=ActionsConfig)
+    inventory: InventoryConfig = field(default_factory=InventoryConfig)
     max_pool_size: int = 10
+    # start update of approved controllers without waiting for the validation end
+    pipeline: bool = False
     # white list of controllers uid
     controllers_blacklist: set[str] = field(default_factory=set)
     # black list of controllers uid. Ignored if whitelist provided
     controllers_whitelist: set[str] = field(default_factory=set)
     # regex expression, that will be used to filter controllers uids
     controller_uid_regex: str | None = None
+    # additional include and exclude regex expressions for controllers uids
+    controller_uid_regexes: list[str] = field(default_factory=list)
+    controller_uid_exclude_regexes: list[str] = field(default_factory=list)
+    # newline-delimited files with uids, extending the lists above
+    controllers_whitelist_file: str | None = None
+    controllers_blacklist_file: str | None = None
+    # brokers updated concurrently in one run
+    brokers: list[BrokerConfig] = field(default_factory=list)
+    # limit of the controllers processed at the same time by all brokers
+    max_total_pool_size: int | None = None
 
     def __post_init__(self):
+        self.brokers = [BrokerConfig(**b) if isinstance(b, dict) else b
+                        for b in self.brokers]
         if isinstance(self.websockets, dict):
             self.websockets = WebsocketsConfig(**self.websockets)
         if isinstance(self.report_writer, dict):
             self.report_writer = ReportConfig(**self.report_writer)
         if isinstance(self.actions, dict):
             self.actions = ActionsConfig(**self.actions)
+        if isinstance(self.inventory, dict):
+            self.inventory = InventoryConfig(**self.inventory)
 
 
-@dataclass
+@dataclass(slots=True)
 class ControllerStatus:
     uid: str
     status: Literal["online", "inactive", "offline"]
@@ -87,3 +287,11 @@ class WorkerResponse:
     response: Any
     uid: str
     status: Literal["success", "error"]
+    # number of attempts made by the retry policy
+    attempts: int = 1
+    # "connect", "timeout" or "error", if known
+    error_kind: str | None = None
+    # seconds from the command to the result
+    duration: float | None = None
+    # "frame", "stall" or "deadline" for the timed out update
+    timeout_reason: str | None = None
@@ -0,0 +1,255 @@
+from dataclasses import dataclass, field
+import time
+from typing import Any, Callable, Literal
+
+from core import colors
+from executor import END_OF_EXECUTION, Channel
+
+
+@dataclass(slots=True)
+class Event:
+    ts: float = field(default_factory=time.time, kw_only=True)
+    # name of the broker in the multi-broker run
+    broker: str | None = field(default=None, kw_only=True)
+
+
+@dataclass(slots=True)
+class PhaseStarted(Event):
+    # "discover", "validate" or "update"
+    phase: str
+
+
+@dataclass(slots=True)
+class PhaseFinished(Event):
+    phase: str
+    # totals of the phase summary, e.g. total_approved_controllers
+    totals: dict[str, int] = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class PhaseSkipped(Event):
+    phase: str
+    # "disabled" in config or "empty" list of the controllers
+    reason: str = "disabled"
+
+
+@dataclass(slots=True)
+class WaveStarted(Event):
+    number: int
+    waves: int = 1
+    size: int = 0
+
+
+@dataclass(slots=True)
+class RolloutHalted(Event):
+    # number of the wave, that exceeded the failure threshold
+    wave: int
+
+
+@dataclass(slots=True)
+class Notice(Event):
+    message: str
+    level: Literal["info", "warning", "error"] = "info"
+
+
+@dataclass(slots=True)
+class ControllerEvent(Event):
+    uid: str
+
+
+@dataclass(slots=True)
+class Discovered(ControllerEvent):
+    status: str = "online"
+
+
+@dataclass(slots=True)
+class ValidationEvent(ControllerEvent):
+    # position of the controller in the validation and the total,
+    # if the number of the controllers is known
+    index: int = 0
+    total: int | None = None
+    attempts: int = 1
+
+
+@dataclass(slots=True)
+class Approved(ValidationEvent):
+    versions: dict[str, str] = field(default_factory=dict)
+    cached: bool = False
+
+
+@dataclass(slots=True)
+class UpToDate(ValidationEvent):
+    versions: dict[str, str] = field(default_factory=dict)
+    cached: bool = False
+
+
+@dataclass(slots=True)
+class Rejected(ValidationEvent):
+    error_kind: str | None = None
+
+
+@dataclass(slots=True)
+class Progress(ControllerEvent):
+    progress: Any = None
+    stage: str | None = None
+
+
+@dataclass(slots=True)
+class Updated(ControllerEvent):
+    duration: float | None = None
+    attempts: int = 1
+
+
+@dataclass(slots=True)
+class Failed(ControllerEvent):
+    # response of the controller, None for the timed out update
+    response: Any = None
+    timeout_reason: str | None = None
+    attempts: int = 1
+
+
+@dataclass(slots=True)
+class Retrying(ControllerEvent):
+    # kind of the failure of the attempt: "connect", "timeout" or "error"
+    kind: str = "error"
+    attempt: int = 1
+    attempts: int = 1
+    # seconds before the next attempt
+    delay: float = 0.0
+
+
+@dataclass(slots=True)
+class WorkerError(ControllerEvent):
+    # unexpected exception of the worker
+    error: str = ""
+
+
+class EventBus:
+    """
+    Delivers events of the run to the subscribed callbacks as soon as
+    they are emitted, and to the async streams opened with stream()
+    """
+
+    def __init__(self) -> None:
+        self.subscribers: list[Callable[[Event], None]] = []
+        self.streams: list[Channel] = []
+
+    @classmethod
+    def console(cls) -> "EventBus":
+        """
+        Bus, that prints events to the terminal
+        """
+        bus = cls()
+        bus.subscribe(ConsolePrinter())
+        return bus
+
+    def subscribe(self, callback: Callable[[Event], None]):
+        self.subscribers.append(callback)
+
+    def tagged(self, broker: str) -> "EventBus":
+        """
+        Bus, that forwards events to this one marked with the broker name
+        """
+        bus = EventBus()
+
+        def forward(event: Event):
+            event.broker = broker
+            self.emit(event)
+        bus.subscribe(forward)
+        return bus
+
+    def stream(self) -> Channel:
+        """
+        Async iterable of the events emitted after the call,
+        until the bus is closed
+        """
+        channel = Channel()
+        self.streams.append(channel)
+        return channel
+
+    def emit(self, event: Event):
+        for callback in self.subscribers:
+            callback(event)
+        for channel in self.streams:
+            channel.queue.put_nowait(event)
+
+    def close(self):
+        for channel in self.streams:
+            channel.queue.put_nowait(END_OF_EXECUTION)
+        self.streams = []
+
+
+class ConsolePrinter:
+    """
+    Prints events the way the command line tool always did
+    """
+
+    PHASE_TITLES = {
+        "discover": "Request all connected controllers:",
+        "validate": "Validate connected controllers:",
+        "update": "Update connected controllers:",
+    }
+    PHASE_TOTALS = {
+        "discover": (("total_available", "controllers available"),),
+        "validate": (
+            ("total_up_to_date_controllers", "controllers up to date"),
+            ("total_approved_controllers", "controllers approved"),
+        ),
+        "update": (("total_updated_controllers", "controllers updated"),),
+    }
+
+    def __call__(self, event: Event):
+        tag = [] if event.broker is None else [colors.blue(event.broker)]
+        match event:
+            case ValidationEvent():
+                prefix = f"[{event.index}/{"?" if event.total is None
+                                           else event.total}]"
+                match event:
+                    case Approved():
+                        print(*tag, prefix, event.uid,
+                              colors.green("APPROVED"))
+                    case UpToDate():
+                        print(*tag, prefix, event.uid,
+                              colors.blue("UP TO DATE"))
+                    case Rejected():
+                        print(*tag, prefix, event.uid, colors.red("REJECTED"))
+            case Updated():
+                print(*tag, event.uid, colors.green("UPDATED"))
+            case Retrying():
+                print(*tag, event.uid, colors.yellow(
+                    f"{event.kind.upper()}, retry in {event.delay:.1f}s "
+                    f"({event.attempt}/{event.attempts})"))
+            case WorkerError():
+                print(*tag, event.uid, colors.red(event.error))
+            case PhaseStarted():
+                print(f"\n{" ".join(tag + [self.PHASE_TITLES[event.phase]])}")
+            case PhaseFinished():
+                for key, label in self.PHASE_TOTALS[event.phase]:
+                    if key in event.totals:
+                        print(*tag, event.totals[key], label)
+            case PhaseSkipped(reason="empty"):
+                print(*tag, colors.yellow("No controllers to update."),
+                      "Exit.", sep="\n")
+            case PhaseSkipped():
+                action = ("Validation" if event.phase == "validate"
+                          else "Update")
+                print(*tag, colors.yellow(
+                    f"{action} action is disable in config. Skip."))
+            case WaveStarted():
+                print(*tag, f"Wave {event.number}/{event.waves}:",
+                      event.size, "controllers")
+            case RolloutHalted():
+                print(*tag, colors.red("Rollout halted: failure threshold "
+                                       "of the wave exceeded"))
+            case Notice():
+                color = {"warning": colors.yellow, "error": colors.red}.get(
+                    event.level, str)
+                print(*tag, color(event.message))
+            case Failed():
+                if event.response:
+                    label = "FAILED"
+                elif event.timeout_reason in ("stall", "deadline"):
+                    label = f"TIMEOUT ({event.timeout_reason})"
+                else:
+                    label = "TIMEOUT"
+                print(*tag, event.uid, "update", colors.red(label))
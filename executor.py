@@ -1,17 +1,26 @@
 import asyncio
-from typing import Any, Awaitable, Callable, Iterable
+import time
+from typing import (Any, AsyncIterable, AsyncIterator, Awaitable, Callable,
+                    Iterable, Iterator)
 
 from core import colors
-from dtos import Config, WorkerResponse
+from dtos import AdaptiveConcurrencyConfig, Config, WorkerResponse
 
 
 class END_OF_EXECUTION:
     ...
 
 
+def print_error(payload: Any, error: Exception):
+    print(payload, colors.red(f"{type(error).__name__}: {error}"))
+
+
 class ExecutorResult:
-    def __init__(self, queue: asyncio.Queue):
+    def __init__(self, queue: asyncio.Queue,
+                 task: asyncio.Task | None = None):
         self.queue = queue
+        # task of the executor, that produces the results
+        self.task = task
 
     def __aiter__(self):
         return self
@@ -19,49 +28,226 @@ class ExecutorResult:
     async def __anext__(self) -> WorkerResponse:
         resp = await self.queue.get()
         if resp is END_OF_EXECUTION:
+            # keep the mark for the other consumers
+            self.queue.put_nowait(END_OF_EXECUTION)
+            self.__raise_error()
             raise StopAsyncIteration
         return resp
 
+    def __raise_error(self):
+        """
+        Raise the error, that stopped the executor
+        """
+        task = self.task
+        if task is None or not task.done() or task.cancelled():
+            return
+        if task.exception() is not None:
+            raise task.exception()
+
+    def close(self):
+        """
+        Stop the executor, if the results are not consumed anymore
+        """
+        if self.task is not None:
+            self.task.cancel()
+
+
+class Channel(ExecutorResult):
+    """
+    Async iterable, that yields items as soon as they are put,
+    until the channel is closed
+    """
+
+    def __init__(self):
+        super().__init__(queue=asyncio.Queue())
+
+    async def put(self, item: Any):
+        await self.queue.put(item)
+
+    async def close(self):
+        await self.queue.put(END_OF_EXECUTION)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit. The limit grows by `increase_step` after
+    every `limit` healthy results and is multiplied by `decrease_factor`
+    on the error. Errors of the tasks started before the last decrease
+    don't decrease the limit again
+    """
+
+    def __init__(self, config: AdaptiveConcurrencyConfig) -> None:
+        self.config = config
+        self.min_limit = max(config.min_pool_size, 1)
+        self.max_limit = max(config.max_pool_size, self.min_limit)
+        self.limit = min(max(config.initial_pool_size or self.min_limit,
+                             self.min_limit), self.max_limit)
+        self.in_flight = 0
+        self.healthy = 0
+        self.start = time.monotonic()
+        self.last_decrease = self.start
+        self.cond = asyncio.Condition()
+        self.log: list[dict] = []
+        self.__log("initial")
+
+    def __log(self, reason: str):
+        self.log.append({
+            "time": round(time.monotonic() - self.start, 3),
+            "limit": self.limit,
+            "reason": reason,
+        })
+
+    async def acquire(self) -> float:
+        """
+        Wait for the free slot. Return start time of the task
+        """
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started: float | None = None,
+                      result: WorkerResponse | None = None):
+        async with self.cond:
+            self.in_flight -= 1
+            if result is not None:
+                self.__adjust(started, result)
+            self.cond.notify_all()
+
+    def __adjust(self, started: float, result: WorkerResponse):
+        if result.status == "error":
+            self.healthy = 0
+            if started < self.last_decrease or self.limit == self.min_limit:
+                return
+            self.limit = max(int(self.limit * self.config.decrease_factor),
+                             self.min_limit)
+            self.last_decrease = time.monotonic()
+            self.__log("timeout" if result.response is None else "error")
+            return
+        latency = time.monotonic() - started
+        max_latency = self.config.max_latency
+        if max_latency is not None and latency > max_latency:
+            return
+        self.healthy += 1
+        if self.healthy >= self.limit and self.limit < self.max_limit:
+            self.healthy = 0
+            self.limit = min(self.limit + self.config.increase_step,
+                             self.max_limit)
+            self.__log("healthy")
+
 
 class PoolExecutor:
-    def __init__(self, config: Config) -> None:
+    """
+    Fixed-size worker pool. `max_pool_size` long-lived workers pull
+    payload items one by one from a shared iterator, so no more than
+    `max_pool_size` items are processed at the same time. Results are
+    put into a bounded queue: if nobody consumes them, workers wait.
+    Payload can be an async iterable, e.g. Channel.
+    If limiter is provided, the number of items processed at the same
+    time is controlled by it
+    """
+
+    def __init__(self, config: Config, pool_size: int | None = None,
+                 limiter: AdaptiveLimiter | None = None,
+                 on_error: Callable[[Any, Exception], None] | None = None,
+                 ) -> None:
         self.config = config
-        self.sem = asyncio.Semaphore(config.max_pool_size)
+        self.limiter = limiter
+        # called with the payload and the unexpected exception of the func
+        self.on_error = on_error or print_error
+        self.pool_size = max(pool_size or config.max_pool_size, 1)
+        if limiter is not None:
+            self.pool_size = limiter.max_limit
         self.lock = asyncio.Lock()
-        self.queue = asyncio.Queue()
+        self.payload_lock = asyncio.Lock()
+        self.queue = asyncio.Queue(maxsize=self.pool_size * 2)
+        self.task: asyncio.Task | None = None
+        self.in_flight = 0
 
     def run(
         self,
-        func: Callable[[Any, dict | str], Awaitable[WorkerResponse]],
-        payload: Iterable[Any],
+        func: Callable[[Any], Awaitable[WorkerResponse]],
+        payload: Iterable[Any] | AsyncIterable[Any],
     ) -> ExecutorResult:
         if self.lock.locked():
             print(colors.red("EXECUTOR ALREADY RUNNING"))
             return
-        asyncio.create_task(self.__run_task(func=func, payload=payload))
-        return ExecutorResult(queue=self.queue)
+        self.task = asyncio.create_task(
+            self.__run_task(func=func, payload=payload))
+        return ExecutorResult(queue=self.queue, task=self.task)
 
     async def __run_task(
         self,
-        func: Callable[[dict | str], Awaitable[WorkerResponse]],
-        payload: Iterable[Any],
+        func: Callable[[Any], Awaitable[WorkerResponse]],
+        payload: Iterable[Any] | AsyncIterable[Any],
     ):
         async with self.lock:
-            tasks = set()
-            for p in payload:
-                async with self.sem:
-                    task = asyncio.create_task(
-                        self.__wrapper(func=func, payload=p)
-                    )
-                    tasks.add(task)
-            if tasks:
-                await asyncio.wait(tasks)
+            if isinstance(payload, AsyncIterable):
+                payload_iter = aiter(payload)
+            else:
+                payload_iter = iter(payload)
+            workers = [
+                asyncio.create_task(
+                    self.__worker(func=func, payload_iter=payload_iter))
+                for _ in range(self.pool_size)
+            ]
+            try:
+                await asyncio.gather(*workers)
+            except asyncio.CancelledError:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                # results are not consumed anymore. The queue may be
+                # full, so drop them to leave room for the end mark
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait(END_OF_EXECUTION)
+                raise
+            except Exception:
+                for worker in workers:
+                    worker.cancel()
+                await self.queue.put(END_OF_EXECUTION)
+                raise
             await self.queue.put(END_OF_EXECUTION)
 
-    async def __wrapper(
+    async def __worker(
         self,
-        func: Callable[[dict | str], Awaitable[WorkerResponse]],
-        payload: dict | str,
+        func: Callable[[Any], Awaitable[WorkerResponse]],
+        payload_iter: Iterator[Any] | AsyncIterator[Any],
     ):
-        result = await func(payload)
-        await self.queue.put(result)
+        while True:
+            started = None
+            if self.limiter is not None:
+                started = await self.limiter.acquire()
+            p = await self.__next(payload_iter)
+            if p is END_OF_EXECUTION:
+                if self.limiter is not None:
+                    await self.limiter.release()
+                return
+            self.in_flight += 1
+            result = await self.__call(func=func, payload=p)
+            self.in_flight -= 1
+            if self.limiter is not None:
+                await self.limiter.release(started, result)
+            await self.queue.put(result)
+
+    async def __next(
+        self,
+        payload_iter: Iterator[Any] | AsyncIterator[Any],
+    ) -> Any:
+        if isinstance(payload_iter, AsyncIterator):
+            async with self.payload_lock:
+                return await anext(payload_iter, END_OF_EXECUTION)
+        return next(payload_iter, END_OF_EXECUTION)
+
+    async def __call(
+        self,
+        func: Callable[[Any], Awaitable[WorkerResponse]],
+        payload: Any,
+    ) -> WorkerResponse:
+        try:
+            return await func(payload)
+        except Exception as e:
+            self.on_error(payload, e)
+            return WorkerResponse(response=repr(e), uid=str(payload),
+                                  status="error")
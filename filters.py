@@ -0,0 +1,95 @@
+from itertools import chain
+import re
+from typing import Generator, Iterable
+
+from dtos import Config, ControllerStatus
+
+
+def read_uids(file_path: str) -> Generator[str, None, None]:
+    """
+    Read newline-delimited uids. Empty lines and lines starting
+    with `#` are skipped
+    """
+    with open(file_path) as file:
+        for line in file:
+            uid = line.strip()
+            if uid and not uid.startswith("#"):
+                yield uid
+
+
+def combine_patterns(patterns: Iterable[str]) -> re.Pattern | None:
+    """
+    Compile several regular expressions into the single one,
+    that matches if any of them matches
+    """
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+class ControllerFilter:
+    """
+    Selects controllers by whitelist, blacklist and uid patterns.
+    If whitelist is provided, blacklist is ignored
+    """
+
+    def __init__(
+        self,
+        whitelist: Iterable[str] = (),
+        blacklist: Iterable[str] = (),
+        include_patterns: Iterable[str] = (),
+        exclude_patterns: Iterable[str] = (),
+    ) -> None:
+        # dict keeps the order of the whitelist for the missing controllers
+        self.whitelist = dict.fromkeys(whitelist)
+        self.blacklist = set() if self.whitelist else set(blacklist)
+        self.include = combine_patterns(include_patterns)
+        self.exclude = combine_patterns(exclude_patterns)
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ControllerFilter":
+        whitelist = config.controllers_whitelist or ()
+        if config.controllers_whitelist_file:
+            whitelist = chain(whitelist,
+                              read_uids(config.controllers_whitelist_file))
+        blacklist = config.controllers_blacklist or ()
+        if config.controllers_blacklist_file:
+            blacklist = chain(blacklist,
+                              read_uids(config.controllers_blacklist_file))
+        return cls(
+            whitelist=whitelist,
+            blacklist=blacklist,
+            include_patterns=[config.controller_uid_regex,
+                              *config.controller_uid_regexes],
+            exclude_patterns=config.controller_uid_exclude_regexes,
+        )
+
+    def match(self, uid: str) -> bool:
+        if self.whitelist and uid not in self.whitelist:
+            return False
+        if uid in self.blacklist:
+            return False
+        if self.include is not None and not self.include.fullmatch(uid):
+            return False
+        if self.exclude is not None and self.exclude.fullmatch(uid):
+            return False
+        return True
+
+    def filter(
+        self,
+        controllers: Iterable[ControllerStatus],
+    ) -> Generator[ControllerStatus, None, None]:
+        """
+        Yield matching controllers. Whitelisted controllers, that are
+        missing in `controllers`, are yielded as offline at the end
+        """
+        seen = set()
+        for c in controllers:
+            if self.whitelist:
+                seen.add(c.uid)
+            if self.match(c.uid):
+                yield c
+        for uid in self.whitelist:
+            if uid not in seen and self.match(uid):
+                yield ControllerStatus(uid=uid, status="offline")
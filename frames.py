@@ -0,0 +1,80 @@
+import re
+from typing import Any
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+JSON_BACKEND = loads.__module__.split(".")[0]
+
+# string value of the key: "key": "value"
+PEEK_PATTERN = r'"{}"\s*:\s*"([^"\\]*)"'
+
+
+class Frame:
+    """
+    Frame received from the broker. As the broker frames are flat
+    objects, string fields are peeked without decoding the frame.
+    The frame is decoded at most once, when the peek is not
+    conclusive or the whole data is requested
+    """
+
+    __slots__ = ("raw", "__data")
+    patterns: dict[str, re.Pattern] = {}
+
+    def __init__(self, raw: str | bytes) -> None:
+        self.raw = raw if isinstance(raw, str) else raw.decode()
+        self.__data: Any = None
+
+    @classmethod
+    def pattern(cls, key: str) -> re.Pattern:
+        pattern = cls.patterns.get(key)
+        if pattern is None:
+            pattern = cls.patterns[key] = re.compile(
+                PEEK_PATTERN.format(re.escape(key)))
+        return pattern
+
+    def peek(self, key: str) -> str | None:
+        """
+        Value of the key found in the raw frame. None, if the key
+        is missing, occurs more than once or its value is not
+        a plain string
+        """
+        if self.raw.count(f'"{key}"') != 1:
+            return
+        match = self.pattern(key).search(self.raw)
+        if match is None:
+            return
+        return match.group(1)
+
+    def matches(self, key: str, value: str) -> bool:
+        """
+        Return True, if the key has the string value. Substring
+        checks are conclusive for the most frames, others are decoded
+        """
+        if f'"{value}"' not in self.raw:
+            return False
+        if self.raw.count(f'"{key}"') == 1 and (
+                f'"{key}": "{value}"' in self.raw
+                or f'"{key}":"{value}"' in self.raw):
+            return True
+        return self.get(key) == value
+
+    @property
+    def data(self) -> Any:
+        """
+        Decoded frame. Raises ValueError for malformed frames
+        """
+        if self.__data is None:
+            self.__data = loads(self.raw)
+        return self.__data
+
+    def get(self, key: str) -> Any:
+        value = self.peek(key)
+        if value is not None:
+            return value
+        data = self.data
+        if not isinstance(data, dict):
+            return
+        return data.get(key)
@@ -0,0 +1,117 @@
+import asyncio
+
+from connections import BrokerSession
+from dtos import WebsocketsConfig
+from frames import Frame
+from metrics import percentile
+
+HANDSHAKES = ("delay", "ack", "pipeline")
+
+
+class SubscribeHandshake:
+    """
+    admin_subscribe handshake of the single controller session.
+    States by the `websockets.subscribe_handshake` mode:
+
+    * delay: new -> subscribing -> expired, after the fixed delay
+    * ack: new -> subscribing -> subscribed, on the broker
+      acknowledgement, or expired, after the fallback delay
+    * pipeline: new -> pipelined, the command follows the
+      subscription at once
+    * reused: the session was subscribed by the previous phase
+
+    Frames received while waiting for the acknowledgement are kept
+    and returned by recv() first
+    """
+
+    def __init__(self, session: BrokerSession,
+                 config: WebsocketsConfig) -> None:
+        if config.subscribe_handshake not in HANDSHAKES:
+            raise ValueError("Unknown subscribe handshake: "
+                             f"{config.subscribe_handshake}")
+        self.session = session
+        self.mode = config.subscribe_handshake
+        self.delay = config.subscribe_delay
+        self.state = "new"
+        # seconds from admin_subscribe to the moment the command may be sent
+        self.latency: float | None = None
+        self.pending: list[Frame] = []
+
+    async def run(self, message: dict):
+        if self.session.subscribed:
+            self.state = "reused"
+            return
+        loop = asyncio.get_running_loop()
+        await self.session.send(message)
+        self.session.subscribed = True
+        sent = loop.time()
+        match self.mode:
+            case "pipeline":
+                self.state = "pipelined"
+            case "delay":
+                self.state = "subscribing"
+                await asyncio.sleep(self.delay)
+                self.state = "expired"
+            case "ack":
+                self.state = "subscribing"
+                await self.__wait_ack(sent + self.delay)
+        self.latency = loop.time() - sent
+
+    async def __wait_ack(self, fallback: float):
+        try:
+            async with asyncio.timeout_at(fallback):
+                while True:
+                    frame = Frame(await self.session.recv())
+                    if frame.matches("action", "admin_subscribe"):
+                        self.state = "subscribed"
+                        return
+                    self.pending.append(frame)
+        except asyncio.TimeoutError:
+            self.state = "expired"
+
+    async def recv(self) -> Frame:
+        if self.pending:
+            return self.pending.pop(0)
+        return Frame(await self.session.recv())
+
+
+class HandshakeStats:
+    """
+    Final states and latencies of the handshakes of the phase
+    """
+
+    def __init__(self, mode: str) -> None:
+        self.mode = mode
+        self.states: dict[str, int] = {}
+        self.latencies: list[float] = []
+
+    def add(self, handshake: SubscribeHandshake):
+        self.states[handshake.state] = self.states.get(handshake.state, 0) + 1
+        if handshake.latency is not None:
+            self.latencies.append(handshake.latency)
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "mode": self.mode,
+            "states": self.states,
+            "latency_p50": round(percentile(latencies, 50), 4),
+            "latency_p95": round(percentile(latencies, 95), 4),
+            "latency_max": round(latencies[-1], 4) if latencies else 0.0,
+        }
+
+
+def merge_handshakes(summaries: list[dict]) -> dict:
+    """
+    Merge handshake summaries of the shards or brokers. Percentiles
+    can't be merged, they are kept in the reports of the parts only
+    """
+    states: dict[str, int] = {}
+    for summary in summaries:
+        for state, count in summary.get("states", {}).items():
+            states[state] = states.get(state, 0) + count
+    return {
+        "mode": summaries[0].get("mode"),
+        "states": states,
+        "latency_max": max(s.get("latency_max", 0.0) for s in summaries),
+    }
@@ -0,0 +1,263 @@
+"""
+Queries to the run history store (history.sqlite in the directory
+of the reports)
+
+    python history.py [-d REPORTS_DIR] runs [-n LIMIT]
+    python history.py [-d REPORTS_DIR] failing [-n RUNS]
+    python history.py [-d REPORTS_DIR] builds
+    python history.py [-d REPORTS_DIR] controller UID
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+from os import getcwd, path as os_path
+import sqlite3
+import time
+
+from core import colors
+from metrics import percentile
+
+HISTORY_DB_FILE = "history.sqlite"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    report_dir TEXT,
+    build_url TEXT,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    uid TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    status TEXT NOT NULL,
+    build_url TEXT,
+    attempts INTEGER,
+    duration REAL,
+    timeout_reason TEXT
+);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id, phase, status);
+CREATE INDEX IF NOT EXISTS results_uid ON results (uid, ts);
+CREATE INDEX IF NOT EXISTS results_build ON results (build_url, phase);
+CREATE TABLE IF NOT EXISTS run_stats (
+    run_id TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    total INTEGER,
+    failed INTEGER,
+    median_duration REAL,
+    p95_duration REAL,
+    PRIMARY KEY (run_id, phase)
+);
+CREATE TABLE IF NOT EXISTS build_stats (
+    build_url TEXT PRIMARY KEY,
+    runs INTEGER,
+    total INTEGER,
+    failed INTEGER,
+    median_duration REAL,
+    p95_duration REAL,
+    updated REAL
+);
+"""
+RESULT_FIELDS = ("ts", "uid", "phase", "status", "build_url",
+                 "attempts", "duration", "timeout_reason")
+
+
+def connect(dir_path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(os_path.join(dir_path, HISTORY_DB_FILE))
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def duration_stats(durations: list[float]) -> tuple[float | None, float | None]:
+    if not durations:
+        return None, None
+    durations.sort()
+    return percentile(durations, 50), percentile(durations, 95)
+
+
+class HistoryStore:
+    """
+    Results of the run indexed by run id, uid, phase and build url.
+    Records are buffered and committed in batches; aggregates of the
+    run and its build are computed on close
+    """
+
+    def __init__(self, dir_path: str, report_dir: str,
+                 batch_size: int = 500, flush_interval: float = 1.0) -> None:
+        self.dir_path = dir_path
+        self.report_dir = report_dir
+        self.run_id = os_path.basename(report_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.db: sqlite3.Connection | None = None
+        self.buffer: list[tuple] = []
+        self.flushed = time.monotonic()
+
+    def add(self, record: dict):
+        if self.db is None:
+            self.db = connect(self.dir_path)
+            self.db.execute(
+                "INSERT OR REPLACE INTO runs (run_id, report_dir, started) "
+                "VALUES (?, ?, ?)",
+                (self.run_id, self.report_dir, record.get("ts", time.time())))
+        self.buffer.append((self.run_id,
+                            *(record.get(f) for f in RESULT_FIELDS)))
+        if (len(self.buffer) >= self.batch_size
+                or time.monotonic() - self.flushed > self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self.db is None:
+            return
+        self.db.executemany(
+            f"INSERT INTO results (run_id, {", ".join(RESULT_FIELDS)}) "
+            f"VALUES ({", ".join("?" * (len(RESULT_FIELDS) + 1))})",
+            self.buffer)
+        self.db.commit()
+        self.buffer = []
+        self.flushed = time.monotonic()
+
+    def close(self):
+        if self.db is None:
+            return
+        self.flush()
+        self.__aggregate()
+        self.db.commit()
+        self.db.close()
+        self.db = None
+
+    def __aggregate(self):
+        db = self.db
+        db.execute("DELETE FROM run_stats WHERE run_id = ?", (self.run_id,))
+        phases = [row[0] for row in db.execute(
+            "SELECT DISTINCT phase FROM results WHERE run_id = ?",
+            (self.run_id,))]
+        for phase in phases:
+            total, failed = db.execute(
+                "SELECT COUNT(*), SUM(status = 'error') FROM results "
+                "WHERE run_id = ? AND phase = ?",
+                (self.run_id, phase)).fetchone()
+            median, p95 = duration_stats([row[0] for row in db.execute(
+                "SELECT duration FROM results WHERE run_id = ? AND phase = ? "
+                "AND status = 'success' AND duration IS NOT NULL",
+                (self.run_id, phase))])
+            db.execute("INSERT INTO run_stats VALUES (?, ?, ?, ?, ?, ?)",
+                       (self.run_id, phase, total, failed, median, p95))
+        row = db.execute(
+            "SELECT build_url FROM results WHERE run_id = ? "
+            "AND build_url IS NOT NULL LIMIT 1", (self.run_id,)).fetchone()
+        build_url = row[0] if row else None
+        db.execute("UPDATE runs SET finished = ?, build_url = ? "
+                   "WHERE run_id = ?", (time.time(), build_url, self.run_id))
+        if build_url is None:
+            return
+        runs, total, failed = db.execute(
+            "SELECT COUNT(DISTINCT run_id), COUNT(*), SUM(status = 'error') "
+            "FROM results WHERE build_url = ? AND phase = 'update'",
+            (build_url,)).fetchone()
+        median, p95 = duration_stats([row[0] for row in db.execute(
+            "SELECT duration FROM results WHERE build_url = ? "
+            "AND phase = 'update' AND status = 'success' "
+            "AND duration IS NOT NULL", (build_url,))])
+        db.execute("INSERT OR REPLACE INTO build_stats "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                   (build_url, runs, total, failed, median, p95, time.time()))
+
+
+def format_ts(ts: float | None) -> str:
+    if ts is None:
+        return "-"
+    return datetime.fromtimestamp(ts).strftime("%d-%m-%Y %H:%M:%S")
+
+
+def format_duration(value: float | None) -> str:
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def print_runs(db: sqlite3.Connection, limit: int):
+    runs = db.execute(
+        "SELECT run_id, started, build_url FROM runs "
+        "ORDER BY started DESC LIMIT ?", (limit,)).fetchall()
+    for run_id, started, build_url in runs:
+        print(colors.blue(run_id), format_ts(started), build_url or "-")
+        for phase, total, failed, median, p95 in db.execute(
+                "SELECT phase, total, failed, median_duration, p95_duration "
+                "FROM run_stats WHERE run_id = ?", (run_id,)):
+            print(f"  {phase}: {total} controllers, {failed} failed,",
+                  f"median {format_duration(median)},",
+                  f"p95 {format_duration(p95)}")
+
+
+def print_failing(db: sqlite3.Connection, runs: int):
+    """
+    Controllers failed the update in every of the last runs
+    """
+    rows = db.execute(
+        "WITH last AS (SELECT runs.run_id FROM runs JOIN run_stats "
+        "ON runs.run_id = run_stats.run_id AND run_stats.phase = 'update' "
+        "ORDER BY runs.started DESC LIMIT ?) "
+        "SELECT uid FROM results WHERE phase = 'update' "
+        "AND status = 'error' AND run_id IN last "
+        "GROUP BY uid HAVING COUNT(DISTINCT run_id) = "
+        "(SELECT COUNT(*) FROM last) ORDER BY uid", (runs,)).fetchall()
+    for (uid,) in rows:
+        print(uid)
+    print(len(rows), f"controllers failed the last {runs} rollouts")
+
+
+def print_builds(db: sqlite3.Connection):
+    for build_url, runs, total, failed, median, p95 in db.execute(
+            "SELECT build_url, runs, total, failed, median_duration, "
+            "p95_duration FROM build_stats ORDER BY updated DESC"):
+        print(colors.blue(build_url))
+        print(f"  {runs} runs, {total} updates, {failed} failed,",
+              f"median {format_duration(median)},",
+              f"p95 {format_duration(p95)}")
+
+
+def print_controller(db: sqlite3.Connection, uid: str):
+    for run_id, ts, phase, status, attempts, duration in db.execute(
+            "SELECT run_id, ts, phase, status, attempts, duration "
+            "FROM results WHERE uid = ? ORDER BY ts", (uid,)):
+        status = colors.green(status) if status == "success" \
+            else colors.red(status)
+        print(format_ts(ts), run_id, phase, status,
+              f"attempts {attempts}", format_duration(duration), sep=" | ")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("-d", dest="dir_path", default=getcwd(),
+                        help="directory of the reports")
+    subparsers = parser.add_subparsers(dest="query", required=True)
+    runs = subparsers.add_parser("runs", help="last runs with aggregates")
+    runs.add_argument("-n", dest="limit", type=int, default=10)
+    failing = subparsers.add_parser(
+        "failing", help="controllers failed the last rollouts")
+    failing.add_argument("-n", dest="runs", type=int, default=3)
+    subparsers.add_parser("builds", help="aggregates per build")
+    controller = subparsers.add_parser("controller",
+                                       help="history of the controller")
+    controller.add_argument("uid")
+    args = parser.parse_args()
+    if not os_path.exists(os_path.join(args.dir_path, HISTORY_DB_FILE)):
+        parser.error(f"{HISTORY_DB_FILE} not found in {args.dir_path}")
+    db = connect(args.dir_path)
+    try:
+        match args.query:
+            case "runs":
+                print_runs(db, args.limit)
+            case "failing":
+                print_failing(db, args.runs)
+            case "builds":
+                print_builds(db)
+            case "controller":
+                print_controller(db, args.uid)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
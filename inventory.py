@@ -0,0 +1,106 @@
+import json
+import re
+from typing import Iterable, Iterator
+
+from dtos import ControllerStatus
+from frames import Frame
+
+AVAILABLE_STATUSES = ("online", "inactive")
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+WHITESPACE_CHARS = frozenset(" \t\n\r")
+CONTROLLERS_KEY = '"controllers"'
+
+
+def iter_controllers(raw: str) -> Iterator[ControllerStatus]:
+    """
+    Decode items of the `controllers` array of the get_all_controllers
+    reply one by one, without decoding the whole reply. Falls back to
+    the full decoding, if the array can't be located
+    """
+    key = raw.find(CONTROLLERS_KEY)
+    if key == -1 or raw.count(CONTROLLERS_KEY) != 1:
+        yield from decode_controllers(raw)
+        return
+    index = skip(raw, key + len(CONTROLLERS_KEY))
+    if raw[index:index + 1] != ":":
+        yield from decode_controllers(raw)
+        return
+    index = skip(raw, index + 1)
+    if raw[index:index + 1] != "[":
+        yield from decode_controllers(raw)
+        return
+    scan = json.JSONDecoder().scan_once
+    index = skip(raw, index + 1)
+    if raw[index:index + 1] == "]":
+        return
+    while True:
+        try:
+            item, index = scan(raw, index)
+        except StopIteration as e:
+            raise ValueError(f"Malformed controllers item at {e.value}") from None
+        yield ControllerStatus(item["uid"], item["status"])
+        index = skip(raw, index)
+        if raw[index:index + 1] != ",":
+            return
+        index = skip(raw, index + 1)
+
+
+def skip(raw: str, index: int) -> int:
+    """
+    Index of the first non-whitespace character from the index
+    """
+    if raw[index:index + 1] in WHITESPACE_CHARS:
+        return WHITESPACE.match(raw, index).end()
+    return index
+
+
+def decode_controllers(raw: str) -> Iterator[ControllerStatus]:
+    for item in Frame(raw).data["controllers"]:
+        yield ControllerStatus(uid=item["uid"], status=item["status"])
+
+
+class Inventory:
+    """
+    Uids of the controllers kept in the columns by status.
+    Iteration yields records of the available controllers,
+    online first
+    """
+
+    def __init__(self) -> None:
+        self.columns: dict[str, list[str]] = {
+            "online": [], "inactive": [], "offline": []}
+
+    @classmethod
+    def from_controllers(cls,
+                         controllers: Iterable[ControllerStatus]) -> "Inventory":
+        inventory = cls()
+        for c in controllers:
+            inventory.add(c.uid, c.status)
+        return inventory
+
+    def add(self, uid: str, status: str):
+        if status not in AVAILABLE_STATUSES:
+            status = "offline"
+        self.columns[status].append(uid)
+
+    def exclude(self, uids: set[str]):
+        for status, column in self.columns.items():
+            self.columns[status] = [uid for uid in column if uid not in uids]
+
+    def __iter__(self) -> Iterator[ControllerStatus]:
+        for status in AVAILABLE_STATUSES:
+            for uid in self.columns[status]:
+                yield ControllerStatus(uid=uid, status=status)
+
+    def __len__(self) -> int:
+        return sum(len(self.columns[s]) for s in AVAILABLE_STATUSES)
+
+    def states(self) -> dict:
+        """
+        Content of controllers_states.yaml
+        """
+        return {
+            **self.columns,
+            "total_available": len(self),
+            "total_unavailable": len(self.columns["offline"]),
+        }
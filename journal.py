@@ -0,0 +1,84 @@
+import json
+from os import fsync, path as os_path
+import time
+from typing import Literal
+
+from history import HistoryStore
+
+JOURNAL_FILE = "journal.jsonl"
+
+
+class ProgressJournal:
+    """
+    Append-only journal of the controllers outcomes. Every record is
+    flushed as soon as it is written, so the journal survives the
+    crash or the interruption of the run
+    """
+
+    def __init__(self, dir_path: str, fsync: bool = False,
+                 history: HistoryStore | None = None) -> None:
+        self.file_path = os_path.join(dir_path, JOURNAL_FILE)
+        self.fsync = fsync
+        self.file = None
+        # store, that receives the records as well
+        self.history = history
+
+    def record(self, uid: str, phase: str,
+               status: Literal["success", "error"], **kwargs):
+        self.append({"ts": time.time(), "uid": uid,
+                     "phase": phase, "status": status, **kwargs})
+
+    def append(self, record: dict):
+        if self.file is None:
+            self.file = open(self.file_path, "a")
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        if self.fsync:
+            fsync(self.file.fileno())
+        # carried over records are results of the resumed run
+        if self.history is not None and not record.get("carried_over"):
+            self.history.add(record)
+
+    def carry_over(self, record: dict):
+        """
+        Copy the record of the resumed run to the journal. It is marked
+        with `carried_over`, so it isn't counted as the result of this run
+        """
+        self.append({**record, "carried_over": True})
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.history is not None:
+            self.history.close()
+
+    @staticmethod
+    def load(dir_path: str) -> list[dict]:
+        """
+        Read records of the journal. Broken tail left by the crash is ignored
+        """
+        records = []
+        file_path = os_path.join(dir_path, JOURNAL_FILE)
+        if not os_path.exists(file_path):
+            return records
+        with open(file_path) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    @classmethod
+    def updated_controllers(cls, dir_path: str, build_url: str) -> list[dict]:
+        """
+        Last successful update records of the controllers updated
+        with the build. Records of failed later attempts override them
+        """
+        last: dict[str, dict] = {}
+        for record in cls.load(dir_path):
+            if record.get("phase") == "update":
+                last[record["uid"]] = record
+        return [r for r in last.values()
+                if r["status"] == "success" and r.get("build_url") == build_url]
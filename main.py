@@ -1,26 +1,303 @@
 import asyncio
+from concurrent.futures import ProcessPoolExecutor
 import json
 from dataclasses import asdict
+from multiprocessing import get_context
+from os import path as os_path
+from typing import Iterable
 
 from actions import GetControllers, UpdateControllers, ValidateControllers
-from core import CustomEncoder
-from dtos import Config
+from brokers import broker_config, merge_brokers
+from connections import ConnectionsAbc, build_connections
+from core import CustomEncoder, ainput, colors
+from dtos import Config, ControllerStatus
+from events import EventBus, Notice
+from executor import Channel
+from filters import ControllerFilter
+from inventory import Inventory
+from journal import ProgressJournal
+from shards import merge_reports, new_event_loop, split_controllers
+from snapshot import InventorySnapshot
 from writer import ReportWriter
 from config_produser import ConfigProdiser
 
 
 class App:
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, resume_dir: str | None = None,
+                 workers: int = 1, dir_path: str | None = None,
+                 events: EventBus | None = None,
+                 confirmed: bool = False) -> None:
         self.config = config
-        self.writer = ReportWriter(config.report_writer)
+        # events of the run, printed to the terminal by default
+        self.events = events or EventBus.console()
+        # skip the confirmation prompts
+        self.confirmed = confirmed
+        self.writer = ReportWriter(config.report_writer, dir_path=dir_path)
+        self.resume_dir = resume_dir
+        self.workers = workers
+        # controllers, which status didn't change since the last run
+        self.unchanged: set[str] = set()
+        # limit of the workers shared by the brokers of the run
+        self.limit: asyncio.Semaphore | None = None
+        # carry over the records of the resumed run to the journal
+        self.carry_over = True
+
+    async def confirm(self, prompt: str):
+        """
+        Ask for the confirmation once, unless the run is confirmed
+        """
+        if not (self.confirmed or ConfigProdiser.already_confirmed()):
+            await ainput(prompt)
+            self.confirmed = True
+
+    def close_writer(self):
+        self.writer.close()
+        stats = self.writer.writer_stats
+        if stats and stats["write_errors"]:
+            self.events.emit(Notice(
+                f"Report writer failed {stats["write_errors"]} times, "
+                f"{stats["failed_records"]} records lost: "
+                f"{stats["last_error"]}", level="error"))
 
     async def run_actions(self):
-        controllers = await GetControllers(
-            self.config, self.writer).run()
-        controllers_uids = await ValidateControllers(
-            self.config, self.writer).run(controllers)
-        await UpdateControllers(
-            self.config, self.writer).run(controllers_uids)
+        if self.config.brokers:
+            try:
+                await self.run_brokers()
+            finally:
+                self.close_writer()
+            return
+        connections = build_connections(self.config, self.events)
+        try:
+            controllers = await GetControllers(
+                self.config, self.writer, connections, self.events).run()
+            self.update_snapshot(controllers)
+            if self.resume_dir:
+                controllers = self.skip_updated(controllers)
+            if self.workers > 1:
+                await self.run_shards(controllers)
+                return
+            await self.run_phases(controllers, connections)
+        finally:
+            await connections.close()
+            self.close_writer()
+
+    async def run_phases(self, controllers: Iterable[ControllerStatus],
+                         connections: ConnectionsAbc):
+        validator = ValidateControllers(self.config, self.writer,
+                                        connections, self.events)
+        validator.unchanged = self.unchanged
+        updater = UpdateControllers(self.config, self.writer,
+                                    connections, self.events)
+        validator.limit = updater.limit = self.limit
+        validator.confirmed = updater.confirmed = self.confirmed
+        if self.config.actions.update.priority.enabled:
+            updater.inactive = {c.uid for c in controllers
+                                if c.status == "inactive"}
+        if self.pipeline_enabled():
+            await self.run_pipeline(controllers, validator, updater)
+            return
+        controllers_uids = await validator.run(controllers)
+        await updater.run(controllers_uids)
+
+    async def run_shard(self, controllers: Iterable[ControllerStatus]):
+        connections = build_connections(self.config, self.events)
+        try:
+            await self.run_phases(controllers, connections)
+        finally:
+            await connections.close()
+            self.close_writer()
+
+    async def run_shards(self, controllers: Iterable[ControllerStatus]):
+        """
+        Validate and update controllers in the worker processes.
+        Controllers are split by the hash of uid, every shard writes
+        its report into the subdirectory of the report directory
+        """
+        await self.confirm("Push Enter to validate and update controllers "
+                           "or Ctrl+C to exit")
+        shards = split_controllers(controllers, self.workers)
+        shard_dirs = [os_path.join(self.writer.dir_path, f"shard_{i}")
+                      for i in range(len(shards))]
+        self.events.emit(Notice(
+            f"\nRun {self.workers} workers: "
+            f"{", ".join(str(len(shard)) for shard in shards)} controllers"))
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=get_context("spawn")) as pool:
+            await asyncio.gather(*(
+                loop.run_in_executor(
+                    pool, run_shard, self.config, shard, dir_path,
+                    {c.uid for c in shard} & self.unchanged)
+                for shard, dir_path in zip(shards, shard_dirs)
+            ))
+        merge_reports(self.writer, shard_dirs)
+
+    async def run_brokers(self):
+        """
+        Validate and update controllers of all brokers concurrently.
+        Every broker writes its report into the subdirectory of the
+        report directory
+        """
+        await self.confirm("Push Enter to validate and update controllers "
+                           "or Ctrl+C to exit")
+        if self.workers > 1:
+            self.events.emit(Notice("Workers are not supported with "
+                                    "brokers. Run brokers in one process.",
+                                    level="warning"))
+        limit = None
+        if self.config.max_total_pool_size:
+            limit = asyncio.Semaphore(self.config.max_total_pool_size)
+        apps: dict[str, App] = {}
+        for broker in self.config.brokers:
+            app = App(broker_config(self.config, broker),
+                      resume_dir=self.resume_dir,
+                      dir_path=os_path.join(self.writer.dir_path, broker.name),
+                      events=self.events.tagged(broker.name),
+                      confirmed=True)
+            app.limit = limit
+            app.carry_over = False
+            apps[broker.name] = app
+        if self.resume_dir:
+            for record in ProgressJournal.updated_controllers(
+                    self.resume_dir, build_url=self.config.software_build_url):
+                self.writer.journal.carry_over(record)
+        self.events.emit(Notice(f"\nRun {len(apps)} brokers: "
+                                f"{", ".join(apps)}"))
+        results = await asyncio.gather(
+            *(app.run_actions() for app in apps.values()),
+            return_exceptions=True)
+        errors = {}
+        for name, result in zip(apps, results):
+            if isinstance(result, Exception):
+                errors[name] = f"{type(result).__name__}: {result}"
+                self.events.emit(Notice(f"Broker {name} failed: "
+                                        f"{errors[name]}", level="error"))
+            elif isinstance(result, BaseException):
+                raise result
+        merge_brokers(self.writer,
+                      {name: app.writer.dir_path for name, app in apps.items()},
+                      errors)
+
+    def update_snapshot(self, controllers: Inventory):
+        """
+        Save statuses of the controllers to the inventory cache.
+        In the incremental mode remember the controllers, which
+        status didn't change since the last run
+        """
+        if not (self.config.inventory.cache
+                or self.config.inventory.incremental):
+            return
+        snapshot = InventorySnapshot(
+            self.config.report_writer.build_report_dir_path())
+        if self.config.inventory.incremental:
+            diff = snapshot.diff(controllers)
+            self.unchanged = set(diff["unchanged"])
+            self.writer.write_yaml_file(
+                file_name="inventory_diff.yaml",
+                data={
+                    "new_controllers": diff["new"],
+                    "changed_controllers": diff["changed"],
+                    "total_new_controllers": len(diff["new"]),
+                    "total_changed_controllers": len(diff["changed"]),
+                    "total_unchanged_controllers": len(diff["unchanged"]),
+                })
+            self.events.emit(Notice(
+                f"{len(diff["new"])} new and {len(diff["changed"])} "
+                "changed controllers since the last run"))
+        snapshot.update(controllers)
+        snapshot.save()
+
+    def plan(self):
+        """
+        Compute the target controllers from the inventory and versions
+        caches without connecting to the broker
+        """
+        try:
+            snapshot = InventorySnapshot(
+                self.config.report_writer.build_report_dir_path())
+            if not snapshot.entries:
+                print(colors.yellow("Inventory cache is empty. "
+                                    "Run with inventory.cache first."))
+                return
+            controllers = Inventory.from_controllers(
+                ControllerFilter.from_config(self.config).filter(
+                    snapshot.controllers()))
+            validator = ValidateControllers(self.config, self.writer)
+            plan = {"to_update": [], "to_validate": [], "up_to_date": []}
+            for c in controllers:
+                versions = validator.versions.get(c.uid, ignore_ttl=True)
+                if versions is None:
+                    plan["to_validate"].append(c.uid)
+                elif validator.is_up_to_date(versions):
+                    plan["up_to_date"].append(c.uid)
+                else:
+                    plan["to_update"].append(c.uid)
+            plan["unavailable"] = controllers.columns["offline"]
+            totals = {f"total_{k}": len(v) for k, v in plan.items()}
+            print(f"Plan from the inventory cache "
+                  f"({snapshot.age() / 3600:.1f} hours old):")
+            for key, total in totals.items():
+                print(f"  {key.removeprefix("total_")}: {total}")
+            self.writer.write_yaml_file(
+                file_name="plan.yaml",
+                data={**plan, **totals,
+                      "snapshot_age": round(snapshot.age())})
+        finally:
+            self.writer.close()
+
+    def skip_updated(self, controllers: Inventory) -> Inventory:
+        """
+        Exclude controllers, that were updated with the same build
+        in the resumed run. Their records are carried over to the
+        journal of the current run
+        """
+        updated = ProgressJournal.updated_controllers(
+            self.resume_dir, build_url=self.config.software_build_url)
+        if self.carry_over:
+            for record in updated:
+                self.writer.journal.carry_over(record)
+        updated_uids = {r["uid"] for r in updated}
+        self.events.emit(Notice(
+            f"Resume {self.resume_dir}: {len(updated_uids)} "
+            "controllers already updated. Skip.", level="warning"))
+        controllers.exclude(updated_uids)
+        return controllers
+
+    def pipeline_enabled(self) -> bool:
+        actions = self.config.actions
+        return (self.config.pipeline
+                and actions.validate.enabled and actions.update.enabled
+                and not actions.update.waves.enabled)
+
+    async def run_pipeline(self,
+                           controllers: Iterable[ControllerStatus],
+                           validator: ValidateControllers,
+                           updater: UpdateControllers):
+        """
+        Update approved controllers while the validation is still running
+        """
+        await self.confirm("Push Enter to validate and update controllers "
+                           "or Ctrl+C to exit")
+        # the single prompt covers both phases
+        validator.confirmed = updater.confirmed = True
+        channel = Channel()
+        await asyncio.gather(
+            validator.run(controllers, channel=channel),
+            updater.run(channel),
+        )
+
+
+def run_shard(config: Config, controllers: Iterable[ControllerStatus],
+              dir_path: str, unchanged: set[str]):
+    """
+    Entry point of the worker process
+    """
+    # results of the shards get to the history with the merged journal
+    config.report_writer.history = False
+    app = App(config, dir_path=dir_path, confirmed=True)
+    app.unchanged = unchanged
+    with asyncio.Runner(loop_factory=new_event_loop) as runner:
+        runner.run(app.run_shard(controllers))
 
 
 async def main():
@@ -29,9 +306,13 @@ async def main():
         return
     print("Loaded configuration:")
     print(json.dumps(asdict(config), indent=1, cls=CustomEncoder))
+    if ConfigProdiser.is_plan():
+        App(config).plan()
+        return
     if not ConfigProdiser.already_confirmed():
-        input("Push Enter to continue or Ctrl+C to exit.")
-    ws = App(config)
+        await ainput("Push Enter to continue or Ctrl+C to exit.")
+    ws = App(config, resume_dir=ConfigProdiser.get_resume_dir(),
+             workers=ConfigProdiser.get_workers())
     await ws.run_actions()
 
 
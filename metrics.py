@@ -0,0 +1,159 @@
+import asyncio
+from bisect import bisect_left
+import json
+from math import ceil
+from os import path as os_path
+import time
+
+from executor import PoolExecutor
+
+METRICS_JSON_FILE = "metrics.json"
+METRICS_PROM_FILE = "metrics.prom"
+
+# step intervals: name -> (from step, to step)
+INTERVALS = {
+    "connect": ("connect_start", "connect_end"),
+    "subscribe": ("subscribe_sent", "command_sent"),
+    "handshake": ("subscribe_sent", "subscribed"),
+    "first_frame": ("command_sent", "first_frame"),
+    "progress": ("first_frame", "last_progress"),
+    "total": ("connect_start", "done"),
+}
+BUCKETS = (.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile of the sorted values
+    """
+    if not values:
+        return 0.0
+    index = max(ceil(q / 100 * len(values)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+class Metrics:
+    """
+    Timestamps of the worker steps per controller and samples of the
+    executor load. Disabled metrics ignore all calls
+    """
+
+    def __init__(self, enabled: bool = False,
+                 sample_interval: float = 1.0) -> None:
+        self.enabled = enabled
+        self.sample_interval = sample_interval
+        self.start = time.monotonic()
+        self.steps: dict[str, dict[str, dict[str, float]]] = {}
+        self.outcomes: dict[str, dict[str, str]] = {}
+        self.samples: list[dict] = []
+
+    def mark(self, phase: str, uid: str, step: str):
+        if not self.enabled:
+            return
+        self.steps.setdefault(phase, {}).setdefault(uid, {})[step] = \
+            time.monotonic()
+
+    def mark_first(self, phase: str, uid: str, step: str):
+        """
+        Mark the step, if it was not marked yet
+        """
+        if not self.enabled:
+            return
+        self.steps.setdefault(phase, {}).setdefault(uid, {}).setdefault(
+            step, time.monotonic())
+
+    def outcome(self, phase: str, uid: str, status: str):
+        if not self.enabled:
+            return
+        self.outcomes.setdefault(phase, {})[uid] = status
+
+    def watch(self, phase: str, executor: PoolExecutor) -> asyncio.Task | None:
+        """
+        Sample result queue depth and in-flight count of the executor
+        until its task is done
+        """
+        if not self.enabled:
+            return
+        return asyncio.create_task(self.__watch(phase, executor))
+
+    async def __watch(self, phase: str, executor: PoolExecutor):
+        while executor.task is None or not executor.task.done():
+            self.samples.append({
+                "time": round(time.monotonic() - self.start, 3),
+                "phase": phase,
+                "queue_depth": executor.queue.qsize(),
+                "in_flight": executor.in_flight,
+            })
+            await asyncio.sleep(self.sample_interval)
+
+    def durations(self, phase: str) -> dict[str, list[float]]:
+        result: dict[str, list[float]] = {name: [] for name in INTERVALS}
+        for steps in self.steps.get(phase, {}).values():
+            for name, (begin, end) in INTERVALS.items():
+                if begin in steps and end in steps:
+                    result[name].append(steps[end] - steps[begin])
+        for values in result.values():
+            values.sort()
+        return result
+
+    def summary(self) -> dict:
+        phases = {}
+        for phase in self.steps:
+            intervals = {}
+            for name, values in self.durations(phase).items():
+                if not values:
+                    continue
+                intervals[name] = {
+                    "count": len(values),
+                    "mean": sum(values) / len(values),
+                    "p50": percentile(values, 50),
+                    "p95": percentile(values, 95),
+                    "p99": percentile(values, 99),
+                    "max": values[-1],
+                    "histogram": {
+                        str(le): bisect_left(values, le + 1e-12)
+                        for le in BUCKETS
+                    },
+                }
+            statuses: dict[str, int] = {}
+            for status in self.outcomes.get(phase, {}).values():
+                statuses[status] = statuses.get(status, 0) + 1
+            phases[phase] = {"intervals": intervals, "outcomes": statuses}
+        return {"phases": phases, "executor_samples": self.samples}
+
+    def prometheus(self) -> str:
+        metric = "mass_update_step_duration_seconds"
+        lines = [
+            f"# HELP {metric} Duration of the worker steps per controller",
+            f"# TYPE {metric} histogram",
+        ]
+        for phase in self.steps:
+            for name, values in self.durations(phase).items():
+                labels = f'phase="{phase}",step="{name}"'
+                for le in BUCKETS:
+                    count = bisect_left(values, le + 1e-12)
+                    lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {len(values)}')
+                lines.append(f"{metric}_sum{{{labels}}} {sum(values)}")
+                lines.append(f"{metric}_count{{{labels}}} {len(values)}")
+        metric = "mass_update_controllers_total"
+        lines += [
+            f"# HELP {metric} Controllers by phase outcome",
+            f"# TYPE {metric} gauge",
+        ]
+        for phase, outcomes in self.outcomes.items():
+            statuses: dict[str, int] = {}
+            for status in outcomes.values():
+                statuses[status] = statuses.get(status, 0) + 1
+            for status, count in statuses.items():
+                lines.append(
+                    f'{metric}{{phase="{phase}",status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def save(self, dir_path: str):
+        if not self.enabled:
+            return
+        with open(os_path.join(dir_path, METRICS_JSON_FILE), "w") as file:
+            json.dump(self.summary(), file, indent=1)
+        with open(os_path.join(dir_path, METRICS_PROM_FILE), "w") as file:
+            file.write(self.prometheus())
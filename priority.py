@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+from itertools import count
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable
+
+from dtos import PriorityConfig
+from metrics import percentile
+
+POLICIES = ("explicit", "online", "longest")
+
+
+class UpdatePriority:
+    """
+    Sort key of the controllers built from the policies in the order
+    of their importance:
+
+    * explicit - controllers from `uids` first, in their order
+    * online - online controllers before inactive ones
+    * longest - controllers with the longest expected update first
+    """
+
+    def __init__(self, config: PriorityConfig, inactive: set[str],
+                 durations: dict[str, list[float]]) -> None:
+        unknown = set(config.policies) - set(POLICIES)
+        if unknown:
+            raise ValueError(f"Unknown priority policies: {unknown}")
+        self.config = config
+        self.inactive = inactive
+        self.explicit = {uid: i for i, uid in enumerate(config.uids)}
+        self.expected = {uid: percentile(sorted(values), 50)
+                         for uid, values in durations.items() if values}
+        values = sorted(self.expected.values())
+        # expected duration of the controllers without history
+        self.default = percentile(values, 50) if values else 0.0
+
+    def expected_duration(self, uid: str) -> float:
+        return self.expected.get(uid, self.default)
+
+    def key(self, uid: str) -> tuple:
+        key = []
+        for policy in self.config.policies:
+            match policy:
+                case "explicit":
+                    key.append(self.explicit.get(uid, len(self.explicit)))
+                case "online":
+                    key.append(uid in self.inactive)
+                case "longest":
+                    key.append(-self.expected_duration(uid))
+        return tuple(key)
+
+    def order(self, uids: Iterable[str]) -> list[str]:
+        """
+        Sorted uids. Order of the equal ones is kept
+        """
+        return sorted(uids, key=self.key)
+
+
+class PriorityScheduler:
+    """
+    Async iterable, that buffers uids from the source as soon as they
+    arrive and yields the one with the highest priority first
+    """
+
+    def __init__(self, source: AsyncIterable[str],
+                 key: Callable[[str], tuple]) -> None:
+        self.source = source
+        self.key = key
+        self.heap: list[tuple[tuple, int, str]] = []
+        # uids in the order they arrived
+        self.arrived: list[str] = []
+        self.counter = count()
+        self.exhausted = False
+        self.cond = asyncio.Condition()
+        self.task: asyncio.Task | None = None
+
+    async def __drain(self):
+        try:
+            async for uid in self.source:
+                self.arrived.append(uid)
+                async with self.cond:
+                    heapq.heappush(self.heap,
+                                   (self.key(uid), next(self.counter), uid))
+                    self.cond.notify()
+        finally:
+            async with self.cond:
+                self.exhausted = True
+                self.cond.notify_all()
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        if self.task is None:
+            self.task = asyncio.create_task(self.__drain())
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.heap or self.exhausted)
+            if not self.heap:
+                raise StopAsyncIteration
+            return heapq.heappop(self.heap)[2]
+
+
+def estimate_makespan(uids: Iterable[str], workers: int,
+                      duration: Callable[[str], float]) -> float:
+    """
+    Makespan of the list scheduling of the uids in the given order
+    on the `workers` parallel slots
+    """
+    slots = [0.0] * max(workers, 1)
+    for uid in uids:
+        heapq.heapreplace(slots, slots[0] + duration(uid))
+    return max(slots)
@@ -0,0 +1,99 @@
+"""
+Reader of the event log report
+
+    python report_reader.py REPORT_DIR -u UID
+    python report_reader.py REPORT_DIR --export
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+import json
+from os import path as os_path
+from typing import Generator
+
+from writer import EVENT_INDEX_FILE, EVENT_LOG_FILE, TIME_FORMAT, TextFiles
+
+
+class EventLogReader:
+    def __init__(self, dir_path: str) -> None:
+        self.dir_path = dir_path
+        self.log_path = os_path.join(dir_path, EVENT_LOG_FILE)
+        index_path = os_path.join(dir_path, EVENT_INDEX_FILE)
+        if os_path.exists(index_path):
+            with open(index_path) as file:
+                self.index: dict[str, list[int]] = json.load(file)
+        else:
+            # the run was interrupted before the index was written
+            self.index = self.build_index()
+
+    def build_index(self) -> dict[str, list[int]]:
+        """
+        Offsets of the records by uid, read from the log.
+        Broken tail left by the crash is ignored
+        """
+        index: dict[str, list[int]] = {}
+        offset = 0
+        with open(self.log_path, "rb") as file:
+            for line in file:
+                try:
+                    uid = json.loads(line)["uid"]
+                except (ValueError, KeyError):
+                    break
+                index.setdefault(uid, []).append(offset)
+                offset += len(line)
+        return index
+
+    def uids(self) -> list[str]:
+        return list(self.index)
+
+    def history(self, uid: str) -> Generator[dict, None, None]:
+        """
+        Records of the controller in the order they were received
+        """
+        with open(self.log_path, "rb") as file:
+            for offset in self.index.get(uid, []):
+                file.seek(offset)
+                yield json.loads(file.readline())
+
+    def records(self) -> Generator[dict, None, None]:
+        with open(self.log_path, "rb") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+
+    def export(self):
+        """
+        Write records as the text report: file per controller per phase
+        """
+        text_files = TextFiles(max_open_files=64)
+        try:
+            for record in self.records():
+                ts = datetime.fromtimestamp(record["ts"]).strftime(TIME_FORMAT)
+                file_path = os_path.join(self.dir_path, record["phase"],
+                                         f"{record["uid"]}.txt")
+                text_files.write([(file_path, f"{ts} | {record["frame"]}\n")])
+        finally:
+            text_files.close()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("report_dir")
+    parser.add_argument("-u", dest="uid", help="print history of controller")
+    parser.add_argument("--export", action="store_true",
+                        help="export event log to the text report")
+    args = parser.parse_args()
+    reader = EventLogReader(args.report_dir)
+    if args.uid:
+        for record in reader.history(args.uid):
+            ts = datetime.fromtimestamp(record["ts"]).strftime(TIME_FORMAT)
+            print(ts, record["phase"], record["frame"], sep=" | ")
+    if args.export:
+        reader.export()
+    if not args.uid and not args.export:
+        print("\n".join(reader.uids()))
+
+
+if __name__ == "__main__":
+    main()
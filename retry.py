@@ -0,0 +1,77 @@
+import asyncio
+import random
+from typing import Any, Awaitable, Callable, Literal
+
+from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidURI
+
+from dtos import RetryConfig, WorkerResponse
+from events import EventBus, Retrying
+
+ErrorKind = Literal["connect", "timeout", "error"]
+
+
+def classify(resp: WorkerResponse) -> ErrorKind | None:
+    """
+    Kind of the failure of the worker response. None for success
+    """
+    if resp.status == "success":
+        return
+    if resp.error_kind is not None:
+        return resp.error_kind
+    if resp.response is None:
+        return "timeout"
+    return "error"
+
+
+class RetryPolicy:
+    """
+    Repeats the worker call on retryable failures with capped
+    exponential backoff and full jitter
+    """
+
+    def __init__(self, config: RetryConfig,
+                 events: EventBus | None = None) -> None:
+        self.config = config
+        self.events = events or EventBus.console()
+
+    def delay(self, attempt: int) -> float:
+        """
+        Pause before the next attempt, where `attempt` is the number
+        of the failed attempt starting with 1
+        """
+        delay = min(self.config.max_delay,
+                    self.config.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, delay)
+
+    def wrap(
+        self,
+        func: Callable[[Any], Awaitable[WorkerResponse]],
+    ) -> Callable[[Any], Awaitable[WorkerResponse]]:
+        async def wrapper(payload: Any) -> WorkerResponse:
+            attempt = 1
+            while True:
+                resp = await self.__call(func, payload)
+                resp.attempts = attempt
+                kind = classify(resp)
+                if (kind is None or kind not in self.config.retry_on
+                        or attempt >= self.config.attempts):
+                    return resp
+                delay = self.delay(attempt)
+                self.events.emit(Retrying(
+                    resp.uid, kind=kind, attempt=attempt,
+                    attempts=self.config.attempts, delay=delay))
+                await asyncio.sleep(delay)
+                attempt += 1
+        return wrapper
+
+    async def __call(
+        self,
+        func: Callable[[Any], Awaitable[WorkerResponse]],
+        payload: Any,
+    ) -> WorkerResponse:
+        try:
+            return await func(payload)
+        except (ConnectionClosed, InvalidHandshake, InvalidURI,
+                OSError, TimeoutError) as e:
+            return WorkerResponse(response=repr(e), uid=str(payload),
+                                  status="error", error_kind="connect")
@@ -0,0 +1,81 @@
+from os import path as os_path
+from typing import Iterable
+from zlib import crc32
+
+from yaml import load, FullLoader
+
+from dtos import ControllerStatus
+from handshake import merge_handshakes
+from journal import ProgressJournal
+from writer import ReportWriter
+
+try:
+    from uvloop import new_event_loop
+except ImportError:
+    from asyncio import new_event_loop
+
+# summaries of the shards, merged into the report directory
+SHARD_SUMMARIES = ("controllers_states.yaml", "update_result.yaml")
+# merge functions of the nested summaries
+NESTED_MERGES = {"subscribe_handshake": merge_handshakes}
+
+
+def shard_of(uid: str, workers: int) -> int:
+    """
+    Stable shard index of the controller
+    """
+    return crc32(uid.encode()) % workers
+
+
+def split_controllers(
+    controllers: Iterable[ControllerStatus],
+    workers: int,
+) -> list[list[ControllerStatus]]:
+    shards: list[list[ControllerStatus]] = [[] for _ in range(workers)]
+    for c in controllers:
+        shards[shard_of(c.uid, workers)].append(c)
+    return shards
+
+
+def merge_summaries(summaries: list[dict]) -> dict:
+    """
+    Concatenate lists, merge mappings and sum totals of the summaries
+    """
+    merged = {}
+    nested: dict[str, list[dict]] = {}
+    for summary in summaries:
+        for key, value in summary.items():
+            if key in NESTED_MERGES:
+                nested.setdefault(key, []).append(value)
+            elif isinstance(value, list):
+                merged.setdefault(key, []).extend(value)
+            elif isinstance(value, dict):
+                merged.setdefault(key, {}).update(value)
+            elif isinstance(value, int) and not isinstance(value, bool):
+                merged[key] = merged.get(key, 0) + value
+            else:
+                merged.setdefault(key, value)
+    for key, values in nested.items():
+        merged[key] = NESTED_MERGES[key](values)
+    return merged
+
+
+def merge_reports(writer: ReportWriter, shard_dirs: list[str]):
+    """
+    Merge summaries and journals of the shards into the report
+    directory of the writer
+    """
+    for file_name in SHARD_SUMMARIES:
+        summaries = []
+        for dir_path in shard_dirs:
+            file_path = os_path.join(dir_path, file_name)
+            if not os_path.exists(file_path):
+                continue
+            with open(file_path) as file:
+                summaries.append(load(file, Loader=FullLoader) or {})
+        if summaries:
+            writer.write_yaml_file(data=merge_summaries(summaries),
+                                   file_name=file_name)
+    for dir_path in shard_dirs:
+        for record in ProgressJournal.load(dir_path):
+            writer.journal.append(record)
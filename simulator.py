@@ -0,0 +1,238 @@
+"""
+Local broker simulator. Speaks the subset of the broker protocol
+used by the actions and simulates the fleet of controllers
+
+    python simulator.py [-p PORT] [--controllers N] [--latency SECONDS] ...
+"""
+from argparse import ArgumentParser, Namespace
+import asyncio
+from dataclasses import dataclass, fields
+import json
+from math import log
+import random
+from urllib.parse import parse_qs, urlparse
+
+from websockets.asyncio.server import Server, ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+# feedback type of the successfully finished update
+FINISHED_FEEDBACK = "update_finished"
+
+
+@dataclass
+class SimulatorConfig:
+    controllers: int = 1000
+    # shares of the inactive and offline controllers
+    inactive_ratio: float = 0.1
+    offline_ratio: float = 0.05
+    # median and lognormal sigma of the controller response latency, seconds
+    latency: float = 0.05
+    latency_sigma: float = 0.5
+    # share of the controllers, that don't answer get_all_versions
+    validate_failure_ratio: float = 0.02
+    # share of the controllers, that fail update with the error feedback
+    update_failure_ratio: float = 0.02
+    # number of update_progress frames and pause between them, seconds
+    progress_frames: int = 10
+    progress_interval: float = 0.05
+    # share of the controllers, that already run the software_version
+    up_to_date_ratio: float = 0.0
+    software_name: str = "simplehome"
+    software_version: str = "1.0"
+    # acknowledge admin_subscribe with the frame of the same action
+    subscribe_ack: bool = False
+    seed: int = 0
+
+
+class BrokerSimulator:
+    """
+    Feedback of the controller is sent to the connections opened for
+    its uid and to the connections, that sent admin_subscribe for it
+    """
+
+    def __init__(self, config: SimulatorConfig) -> None:
+        self.config = config
+        rnd = random.Random(config.seed)
+        self.statuses: dict[str, str] = {}
+        self.profiles: dict[str, tuple[bool, bool, bool]] = {}
+        for i in range(config.controllers):
+            uid = f"wirenboard-{i:08X}"
+            r = rnd.random()
+            if r < config.offline_ratio:
+                status = "offline"
+            elif r < config.offline_ratio + config.inactive_ratio:
+                status = "inactive"
+            else:
+                status = "online"
+            self.statuses[uid] = status
+            self.profiles[uid] = (
+                rnd.random() < config.validate_failure_ratio,
+                rnd.random() < config.update_failure_ratio,
+                rnd.random() < config.up_to_date_ratio,
+            )
+        self.random = rnd
+        self.subscribers: dict[str, set[ServerConnection]] = {}
+        self.connections = 0
+        self.peak_connections = 0
+        self.frames_sent = 0
+
+    def latency(self) -> float:
+        return self.random.lognormvariate(log(self.config.latency),
+                                          self.config.latency_sigma)
+
+    async def send(self, websocket: ServerConnection, message: dict):
+        await websocket.send(json.dumps(message))
+        self.frames_sent += 1
+
+    def subscribe(self, websocket: ServerConnection, uid: str):
+        self.subscribers.setdefault(uid, set()).add(websocket)
+
+    async def feedback(self, uid: str, message: dict):
+        for websocket in list(self.subscribers.get(uid, ())):
+            try:
+                await self.send(websocket, message)
+            except ConnectionClosed:
+                pass
+
+    async def handler(self, websocket: ServerConnection):
+        self.connections += 1
+        self.peak_connections = max(self.peak_connections, self.connections)
+        query = parse_qs(urlparse(websocket.request.path).query)
+        connection_uid = query.get("uid", ["null"])[0]
+        # uids, which feedback is sent over the connection
+        subscribed = set()
+        if connection_uid != "null":
+            subscribed.add(connection_uid)
+            self.subscribe(websocket, connection_uid)
+        tasks = set()
+        try:
+            async for frame in websocket:
+                message = json.loads(frame)
+                if message.get("action") == "admin_subscribe":
+                    uid = message.get("uid", connection_uid)
+                    subscribed.add(uid)
+                    self.subscribe(websocket, uid)
+                task = asyncio.create_task(
+                    self.process(websocket, message, connection_uid))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.connections -= 1
+            for task in tasks:
+                task.cancel()
+            for uid in subscribed:
+                self.subscribers[uid].discard(websocket)
+
+    async def process(self, websocket: ServerConnection,
+                      message: dict, connection_uid: str):
+        uid = message.get("uid", connection_uid)
+        match message.get("action"), message.get("command"):
+            case "get_all_controllers", _:
+                await self.send(websocket, {
+                    "action": "get_all_controllers",
+                    "uid": uid,
+                    "controllers": [{"uid": u, "status": s}
+                                    for u, s in self.statuses.items()],
+                })
+            case "admin_subscribe", _:
+                if self.config.subscribe_ack:
+                    await asyncio.sleep(self.latency())
+                    await self.send(websocket, {
+                        "action": "admin_subscribe",
+                        "uid": uid,
+                        "status": "ok",
+                    })
+            case "updater_command", "get_all_versions":
+                await self.get_all_versions(uid)
+            case "updater_command", "update_software":
+                await self.update_software(uid)
+
+    async def get_all_versions(self, uid: str):
+        no_answer, _, up_to_date = self.profiles.get(uid, (True, True, False))
+        if no_answer or self.statuses.get(uid) == "offline":
+            return
+        await asyncio.sleep(self.latency())
+        version = self.config.software_version if up_to_date else "0.0"
+        await self.feedback(uid, {
+            "action": "updater_feedback",
+            "feedback_type": "all_software_versions",
+            "uid": uid,
+            "versions": {self.config.software_name: version,
+                         "sh-updater": "1.0"},
+        })
+
+    async def update_software(self, uid: str):
+        _, fail, _ = self.profiles.get(uid, (True, True, False))
+        if self.statuses.get(uid, "offline") == "offline":
+            return
+        await asyncio.sleep(self.latency())
+        for i in range(self.config.progress_frames):
+            await self.feedback(uid, {
+                "action": "updater_feedback",
+                "feedback_type": "update_progress",
+                "uid": uid,
+                "progress": round(100 * (i + 1) / self.config.progress_frames),
+                "stage": ("downloading" if 2 * i < self.config.progress_frames
+                          else "installing"),
+            })
+            await asyncio.sleep(self.config.progress_interval)
+        if fail:
+            await self.feedback(uid, {
+                "action": "updater_feedback",
+                "feedback_type": "error",
+                "uid": uid,
+                "message": "Simulated update failure",
+            })
+            return
+        await self.feedback(uid, {
+            "action": "updater_feedback",
+            "feedback_type": FINISHED_FEEDBACK,
+            "uid": uid,
+        })
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> serve:
+        return serve(self.handler, host, port, max_size=None)
+
+
+def server_url(server: Server) -> str:
+    host, port = list(server.sockets)[0].getsockname()[:2]
+    return f"ws://{host}:{port}"
+
+
+def add_arguments(parser: ArgumentParser):
+    """
+    Add SimulatorConfig fields as command line options
+    """
+    for f in fields(SimulatorConfig):
+        name = f"--{f.name.replace("_", "-")}"
+        if isinstance(f.default, bool):
+            parser.add_argument(name, dest=f.name, action="store_true")
+            continue
+        parser.add_argument(name, dest=f.name,
+                            type=type(f.default), default=f.default)
+
+
+def config_from_args(args: Namespace) -> SimulatorConfig:
+    return SimulatorConfig(**{f.name: getattr(args, f.name)
+                              for f in fields(SimulatorConfig)})
+
+
+async def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    simulator = BrokerSimulator(config_from_args(args))
+    async with simulator.serve(args.host, args.port) as server:
+        print("Listening on", server_url(server), flush=True)
+        await asyncio.Future()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,88 @@
+import json
+from os import getpid, path as os_path, replace
+import time
+from typing import Iterator
+
+from dtos import ControllerStatus
+from inventory import Inventory
+
+INVENTORY_CACHE_FILE = "inventory_cache.json"
+
+
+class InventorySnapshot:
+    """
+    Statuses of the controllers seen by the previous runs. Every entry
+    keeps the time the controller was last seen and the time its
+    status changed
+    """
+
+    def __init__(self, dir_path: str) -> None:
+        self.file_path = os_path.join(dir_path, INVENTORY_CACHE_FILE)
+        self.entries: dict[str, dict] = self.load()
+
+    def load(self) -> dict[str, dict]:
+        if not os_path.exists(self.file_path):
+            return {}
+        try:
+            with open(self.file_path) as file:
+                return json.load(file)
+        except ValueError:
+            return {}
+
+    def controllers(self) -> Iterator[ControllerStatus]:
+        for uid, entry in self.entries.items():
+            yield ControllerStatus(uid, entry["status"])
+
+    def age(self) -> float | None:
+        """
+        Seconds since the last update of the snapshot
+        """
+        if not self.entries:
+            return
+        return time.time() - max(e["ts"] for e in self.entries.values())
+
+    def diff(self, inventory: Inventory) -> dict[str, list[str]]:
+        """
+        Split controllers of the inventory into never seen, changed
+        status and unchanged ones
+        """
+        result = {"new": [], "changed": [], "unchanged": []}
+        for status, uids in inventory.columns.items():
+            for uid in uids:
+                entry = self.entries.get(uid)
+                if entry is None:
+                    result["new"].append(uid)
+                elif entry["status"] != status:
+                    result["changed"].append(uid)
+                else:
+                    result["unchanged"].append(uid)
+        return result
+
+    def update(self, inventory: Inventory):
+        """
+        Record statuses of the inventory. Controllers missing in the
+        inventory, e.g. excluded by the filters, are kept
+        """
+        now = time.time()
+        for status, uids in inventory.columns.items():
+            for uid in uids:
+                entry = self.entries.get(uid)
+                if entry is None or entry["status"] != status:
+                    entry = self.entries[uid] = {"status": status,
+                                                 "changed": now}
+                entry["ts"] = now
+
+    def save(self):
+        """
+        Merge entries with the file, the latest seen entry wins.
+        Entries saved by the concurrent runs, e.g. of the other
+        brokers, are kept
+        """
+        for uid, entry in self.load().items():
+            own = self.entries.get(uid)
+            if own is None or own["ts"] < entry["ts"]:
+                self.entries[uid] = entry
+        tmp_path = f"{self.file_path}.{getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.entries, file, separators=(",", ":"))
+        replace(tmp_path, self.file_path)
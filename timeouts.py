@@ -0,0 +1,69 @@
+from os import listdir, path as os_path
+
+from dtos import AdaptiveTimeoutConfig
+from journal import ProgressJournal
+from metrics import percentile
+
+
+def update_durations(base_dir: str, runs: int) -> dict[str, list[float]]:
+    """
+    Durations of the successful updates per controller, recorded
+    in the journals of the last `runs` reports of the directory
+    """
+    if not os_path.isdir(base_dir):
+        return {}
+    report_dirs = sorted(
+        (os_path.join(base_dir, d) for d in listdir(base_dir)
+         if d.startswith("report_")),
+        key=os_path.getmtime)
+    durations: dict[str, list[float]] = {}
+    for dir_path in report_dirs[-runs:]:
+        for record in ProgressJournal.load(dir_path):
+            if (record.get("phase") == "update"
+                    and record.get("status") == "success"
+                    and not record.get("carried_over")
+                    and record.get("duration") is not None):
+                durations.setdefault(record["uid"], []).append(
+                    record["duration"])
+    return durations
+
+
+class UpdateTimeouts:
+    """
+    Deadlines of the updates derived from the durations of the
+    previous runs: percentile of the controller durations multiplied
+    by the factor. Controllers with too few samples get the deadline
+    from the durations of all controllers
+    """
+
+    def __init__(self, config: AdaptiveTimeoutConfig,
+                 durations: dict[str, list[float]]) -> None:
+        self.config = config
+        self.timeouts: dict[str, float] = {}
+        for uid, values in durations.items():
+            if len(values) >= config.min_samples:
+                self.timeouts[uid] = self.__timeout(values)
+        values = [v for values in durations.values() for v in values]
+        self.default: float | None = None
+        if len(values) >= config.min_samples:
+            self.default = self.__timeout(values)
+        self.samples = len(values)
+
+    @classmethod
+    def from_reports(cls, config: AdaptiveTimeoutConfig,
+                     base_dir: str) -> "UpdateTimeouts":
+        return cls(config, update_durations(base_dir, config.history_runs))
+
+    def __timeout(self, values: list[float]) -> float:
+        timeout = percentile(sorted(values), self.config.percentile) \
+            * self.config.factor
+        timeout = max(timeout, self.config.min_timeout)
+        if self.config.max_timeout is not None:
+            timeout = min(timeout, self.config.max_timeout)
+        return timeout
+
+    def get(self, uid: str) -> float | None:
+        """
+        Deadline of the whole update in seconds, None if unknown
+        """
+        return self.timeouts.get(uid, self.default)
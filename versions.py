@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+import json
+from os import getpid, path as os_path, replace
+import time
+from typing import Any, Iterator
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+VERSIONS_CACHE_FILE = "versions_cache.json"
+
+
+@contextmanager
+def file_lock(file_path: str) -> Iterator[None]:
+    """
+    Exclusive lock of the file between processes, held on the
+    `.lock` file next to it. No locking without fcntl
+    """
+    with open(f"{file_path}.lock", "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def extract_versions(resp: dict) -> dict[str, str]:
+    """
+    Installed software versions from the `all_software_versions` feedback.
+    Accepts `{"name": "version"}` mapping or list of
+    `{"name": ..., "version": ...}` items
+    """
+    versions: Any = resp.get("versions", resp.get("data"))
+    if isinstance(versions, dict):
+        return {str(k): str(v) for k, v in versions.items()
+                if not isinstance(v, (dict, list))}
+    if isinstance(versions, list):
+        return {str(v["name"]): str(v["version"]) for v in versions
+                if isinstance(v, dict) and "name" in v and "version" in v}
+    return {}
+
+
+class VersionCache:
+    """
+    Installed versions of the controllers saved between runs.
+    Entries older than `ttl` seconds are ignored
+    """
+
+    def __init__(self, dir_path: str, ttl: int) -> None:
+        self.file_path = os_path.join(dir_path, VERSIONS_CACHE_FILE)
+        self.ttl = ttl
+        self.entries: dict[str, dict] = self.load()
+
+    def load(self) -> dict[str, dict]:
+        if not os_path.exists(self.file_path):
+            return {}
+        try:
+            with open(self.file_path) as file:
+                return json.load(file)
+        except ValueError:
+            return {}
+
+    def get(self, uid: str,
+            ignore_ttl: bool = False) -> dict[str, str] | None:
+        if self.ttl <= 0 and not ignore_ttl:
+            return
+        entry = self.entries.get(uid)
+        if entry is None:
+            return
+        if not ignore_ttl and time.time() - entry["ts"] > self.ttl:
+            return
+        return entry["versions"]
+
+    def set(self, uid: str, versions: dict[str, str]):
+        self.entries[uid] = {"ts": time.time(), "versions": versions}
+
+    def save(self):
+        """
+        Merge entries with the saved ones, so the caches of the
+        parallel shards don't override each other. Newer entries win.
+        The file is locked from the load to the replace
+        """
+        with file_lock(self.file_path):
+            entries = self.load()
+            for uid, entry in self.entries.items():
+                saved = entries.get(uid)
+                if saved is None or saved["ts"] <= entry["ts"]:
+                    entries[uid] = entry
+            self.entries = entries
+            tmp_path = f"{self.file_path}.{getpid()}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.entries, file, separators=(",", ":"))
+            replace(tmp_path, self.file_path)
@@ -0,0 +1,104 @@
+import asyncio
+from math import ceil, floor
+from typing import AsyncIterator
+
+from dtos import WavesConfig, WorkerResponse
+from events import EventBus, WaveStarted
+
+
+class Wave:
+    def __init__(self, number: int, uids: list[str],
+                 max_failure_ratio: float) -> None:
+        self.number = number
+        self.uids = uids
+        self.allowed_failures = floor(len(uids) * max_failure_ratio)
+        self.started = 0
+        self.updated = 0
+        self.failed = 0
+        self.status = "pending"
+        self.decided = asyncio.Event()
+
+    def record(self, resp: WorkerResponse):
+        if resp.status == "success":
+            self.updated += 1
+        else:
+            self.failed += 1
+        if self.decided.is_set():
+            return
+        if self.failed > self.allowed_failures:
+            self.status = "halted"
+            self.decided.set()
+        elif self.updated >= len(self.uids) - self.allowed_failures:
+            # the rest of the wave can't exceed the failure threshold
+            self.status = "passed"
+            self.decided.set()
+
+    def summary(self) -> dict:
+        return {
+            "wave": self.number,
+            "status": self.status if self.started else "skipped",
+            "size": len(self.uids),
+            "updated": self.updated,
+            "failed": self.failed,
+            "skipped": len(self.uids) - self.started,
+        }
+
+
+class WaveScheduler:
+    """
+    Async iterable of controllers uids, split into waves. The next wave
+    starts as soon as the previous one can't exceed `max_failure_ratio`
+    anymore. If the failure threshold of the wave is exceeded, the
+    remaining controllers are not scheduled
+    """
+
+    def __init__(self, config: WavesConfig, uids: list[str],
+                 events: EventBus | None = None) -> None:
+        self.config = config
+        self.events = events or EventBus.console()
+        self.waves: list[Wave] = []
+        self.wave_of: dict[str, Wave] = {}
+        start = 0
+        for size in sorted(config.sizes):
+            end = min(max(ceil(len(uids) * size), start + config.min_wave_size),
+                      len(uids))
+            if end > start:
+                self.__add_wave(uids[start:end])
+            start = end
+        if start < len(uids):
+            self.__add_wave(uids[start:])
+
+    def __add_wave(self, uids: list[str]):
+        wave = Wave(len(self.waves) + 1, uids, self.config.max_failure_ratio)
+        self.waves.append(wave)
+        for uid in uids:
+            self.wave_of[uid] = wave
+
+    @property
+    def halted(self) -> bool:
+        return any(w.status == "halted" for w in self.waves)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        previous: Wave | None = None
+        for wave in self.waves:
+            if previous is not None:
+                await previous.decided.wait()
+            if self.halted:
+                return
+            self.events.emit(WaveStarted(wave.number, waves=len(self.waves),
+                                         size=len(wave.uids)))
+            wave.status = "running"
+            for uid in wave.uids:
+                if self.halted:
+                    return
+                wave.started += 1
+                yield uid
+            previous = wave
+
+    def record(self, resp: WorkerResponse):
+        wave = self.wave_of.get(resp.uid)
+        if wave is not None:
+            wave.record(resp)
+
+    def summary(self) -> list[dict]:
+        return [w.summary() for w in self.waves]
@@ -1,26 +1,306 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from contextlib import contextmanager
 from datetime import datetime
-from io import TextIOWrapper
+from io import BufferedWriter, TextIOWrapper
+import json
 from os import makedirs, path as os_path
+from queue import Empty, Queue
+from threading import Lock, Thread
+import time
 
-from yaml import dump, Dumper
+from yaml import dump
+try:
+    from yaml import CDumper as Dumper
+except ImportError:
+    from yaml import Dumper
 
 from dtos import ReportConfig
+from history import HistoryStore
+from journal import ProgressJournal
+from metrics import Metrics
 
+TIME_FORMAT = "%d-%m-%Y_%H:%M:%S.%s"
+# microseconds, several writers of the process may start in the same second
+DIR_TIME_FORMAT = "%d-%m-%Y_%H:%M:%S.%f"
+EVENT_LOG_FILE = "events.log"
+EVENT_INDEX_FILE = "events.idx"
+
+
+class SinkAbc(ABC):
+    """
+    Destination of the report records. Record is a pair of
+    the key (file path or uid) and the data
+    """
+
+    @abstractmethod
+    def write(self, records: list[tuple[str, str]]):
+        ...
+
+    def flush(self):
+        ...
+
+    def close(self):
+        ...
+
+
+class TextFiles(SinkAbc):
+    """
+    Appends records to the text files. Key is the file path.
+    Open files are kept in the LRU cache
+    """
+
+    def __init__(self, max_open_files: int) -> None:
+        self.max_open_files = max(max_open_files, 1)
+        self.files: OrderedDict[str, TextIOWrapper] = OrderedDict()
+        self.dirs: set[str] = set()
+
+    def write(self, records: list[tuple[str, str]]):
+        grouped: dict[str, list[str]] = {}
+        for file_path, data in records:
+            grouped.setdefault(file_path, []).append(data)
+        for file_path, data in grouped.items():
+            self.__get_file(file_path).write("".join(data))
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    def close(self):
+        while self.files:
+            self.files.popitem()[1].close()
+
+    def __get_file(self, file_path: str) -> TextIOWrapper:
+        file = self.files.get(file_path)
+        if file is not None:
+            self.files.move_to_end(file_path)
+            return file
+        dir_path = os_path.dirname(file_path)
+        if dir_path not in self.dirs:
+            makedirs(dir_path, exist_ok=True)
+            self.dirs.add(dir_path)
+        if len(self.files) >= self.max_open_files:
+            self.files.popitem(last=False)[1].close()
+        file = open(file_path, "+a")
+        self.files[file_path] = file
+        return file
+
+
+class EventLog(SinkAbc):
+    """
+    Single append-only log of the controllers frames. Key is the
+    controller uid, data is the JSON line. Offsets of the records
+    of every uid are saved to the index on close
+    """
+
+    def __init__(self, dir_path: str) -> None:
+        self.dir_path = dir_path
+        self.file: BufferedWriter = open(
+            os_path.join(dir_path, EVENT_LOG_FILE), "ab")
+        self.index: dict[str, list[int]] = {}
+
+    @staticmethod
+    def build_record(uid: str, phase: str, frame: str) -> str:
+        return json.dumps({
+            "ts": time.time(),
+            "phase": phase,
+            "uid": uid,
+            "frame": frame,
+        }) + "\n"
+
+    def write(self, records: list[tuple[str, str]]):
+        offset = self.file.tell()
+        for uid, data in records:
+            record = data.encode()
+            self.index.setdefault(uid, []).append(offset)
+            self.file.write(record)
+            offset += len(record)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        with open(os_path.join(self.dir_path, EVENT_INDEX_FILE), "w") as file:
+            json.dump(self.index, file, separators=(",", ":"))
+
+
+class BackgroundWriter:
+    """
+    Writes records to the sinks in the background thread.
+    Records are written in batches and flushed periodically.
+    Records that don't fit into `max_buffered_bytes` are dropped.
+    Errors of the sinks are counted and don't stop the thread
+    """
+
+    STOP = object()
 
-class ReportWriter:
     def __init__(self, config: ReportConfig) -> None:
         self.config = config
+        self.queue: Queue[tuple[SinkAbc, str, str] | object] = Queue()
+        self.sinks: set[SinkAbc] = set()
+        self.lock = Lock()
+        self.buffered_bytes = 0
+        self.overflowed = False
+        self.stats = {
+            "written_records": 0,
+            "dropped_records": 0,
+            "backpressure_events": 0,
+            "max_buffered_bytes": 0,
+            "write_errors": 0,
+            "failed_records": 0,
+            "last_error": None,
+        }
+        self.thread = Thread(target=self.__run, name="report-writer",
+                             daemon=True)
+        self.thread.start()
+
+    def put(self, sink: SinkAbc, key: str, data: str):
+        size = len(data)
+        with self.lock:
+            if self.buffered_bytes + size > self.config.max_buffered_bytes:
+                if not self.overflowed:
+                    self.overflowed = True
+                    self.stats["backpressure_events"] += 1
+                self.stats["dropped_records"] += 1
+                return
+            self.overflowed = False
+            self.buffered_bytes += size
+            self.stats["max_buffered_bytes"] = max(
+                self.stats["max_buffered_bytes"], self.buffered_bytes)
+        self.queue.put((sink, key, data))
+
+    def close(self):
+        self.queue.put(self.STOP)
+        self.thread.join()
+
+    def __run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.config.flush_interval)]
+            except Empty:
+                batch = []
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            stop = self.STOP in batch
+            self.__write_batch([r for r in batch if r is not self.STOP])
+            now = time.monotonic()
+            if stop or now - last_flush >= self.config.flush_interval:
+                for sink in self.sinks:
+                    try:
+                        sink.flush()
+                    except Exception as e:
+                        self.__error(e)
+                last_flush = now
+            if stop:
+                break
+
+    def __write_batch(self, batch: list[tuple[SinkAbc, str, str]]):
+        grouped: dict[SinkAbc, list[tuple[str, str]]] = {}
+        size = 0
+        for sink, key, data in batch:
+            grouped.setdefault(sink, []).append((key, data))
+            size += len(data)
+        written = 0
+        for sink, records in grouped.items():
+            self.sinks.add(sink)
+            try:
+                sink.write(records)
+                written += len(records)
+            except Exception as e:
+                self.__error(e, records=len(records))
+        with self.lock:
+            self.buffered_bytes -= size
+            self.stats["written_records"] += written
+
+    def __error(self, error: Exception, records: int = 0):
+        with self.lock:
+            self.stats["write_errors"] += 1
+            self.stats["failed_records"] += records
+            self.stats["last_error"] = f"{type(error).__name__}: {error}"
+
+
+def make_report_dir(base_dir: str) -> str:
+    """
+    Create the new report directory named by the current time.
+    A numeric suffix is added, if the name is already taken
+    """
+    name = f"report_{datetime.now().strftime(DIR_TIME_FORMAT)}"
+    dir_path = os_path.join(base_dir, name)
+    suffix = 0
+    while True:
+        try:
+            makedirs(dir_path)
+            return dir_path
+        except FileExistsError:
+            suffix += 1
+            dir_path = os_path.join(base_dir, f"{name}_{suffix}")
+
+
+class ReportWriter:
+    def __init__(self, config: ReportConfig,
+                 dir_path: str | None = None) -> None:
+        """
+        * dir_path: report directory. By default the new directory
+          is created in `config.report_dir_path`
+        """
+        self.config = config
+        if dir_path is None:
+            dir_path = make_report_dir(config.build_report_dir_path())
+        else:
+            makedirs(dir_path)
+        self.dir_path = dir_path
+        history = None
+        if config.history:
+            history = HistoryStore(config.build_report_dir_path(),
+                                   report_dir=self.dir_path)
+        self.journal = ProgressJournal(self.dir_path, fsync=config.journal_fsync,
+                                       history=history)
+        self.metrics = Metrics(enabled=config.metrics,
+                               sample_interval=config.metrics_sample_interval)
+        self.background: BackgroundWriter | None = None
+        # statistics of the background writer, available after close
+        self.writer_stats: dict | None = None
+        self.text_files: TextFiles | None = None
+        self.event_log: EventLog | None = None
+        if config.async_writes:
+            self.background = BackgroundWriter(config)
+            self.text_files = TextFiles(config.max_open_files)
+        if config.report_format == "eventlog":
+            self.event_log = EventLog(self.dir_path)
+
+    def write_detail(self, frame: str, uid: str, phase: str):
+        """
+        Save the frame received from the controller
+
+        * frame: raw frame
+        * uid: controller uid
+        * phase: name of the action, that received the frame
+        """
+        if self.event_log is not None:
+            record = EventLog.build_record(uid=uid, phase=phase, frame=frame)
+            if self.background is not None:
+                self.background.put(self.event_log, key=uid, data=record)
+            else:
+                self.event_log.write([(uid, record)])
+            return
         now = datetime.now()
-        dirname = f"report_{now.strftime("%d-%m-%Y_%H:%M:%S.%s")}"
-        self.dir_path = os_path.join(config.build_report_dir_path(), dirname)
-        makedirs(self.dir_path)
+        self.write_text_file(data=f"{now.strftime(TIME_FORMAT)} | {frame}",
+                             file_name=f"{uid}.txt",
+                             dir_name=phase)
 
     def write_text_file(self, data: str, file_name: str, dir_name: str = ""):
         """
         * file_name: name of the file to write too
         * dir_name: name of the subdir, where file is stored
         """
+        if self.background is not None:
+            self.background.put(
+                self.text_files,
+                key=os_path.join(self.dir_path, dir_name, file_name),
+                data=f"{data}\n")
+            return
         with self.open(file_name, dir_name) as file:
             file.write(data)
             file.write("\n")
@@ -35,6 +315,23 @@ class ReportWriter:
         with self.open(file_name, dir_name) as file:
             dump(data, stream=file, Dumper=Dumper)
 
+    def close(self):
+        """
+        Flush buffered records to the disk
+        """
+        self.journal.close()
+        self.metrics.save(self.dir_path)
+        if self.background is not None:
+            background, self.background = self.background, None
+            background.close()
+            self.text_files.close()
+            self.write_yaml_file(data=background.stats,
+                                 file_name="writer_stats.yaml")
+            self.writer_stats = background.stats
+        if self.event_log is not None:
+            event_log, self.event_log = self.event_log, None
+            event_log.close()
+
     @contextmanager
     def open(self, file_name: str,
              dir_name: str = "",